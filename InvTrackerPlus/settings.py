@@ -89,6 +89,9 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Seconds that a write waits for another one to finish, such as a bulk import
+        # holding the write lock, before failing with "database is locked".
+        "OPTIONS": {"timeout": 20},
     }
 }
 
@@ -135,6 +138,25 @@ STATIC_URL = "static/"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Use a shared backend such as Redis or Memcached in production,
+# so that every worker process shares the same cached rates.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
+# Currency conversion rates are refreshed in the background once they are older than FX_RATE_TTL seconds.
+FX_RATE_TTL = 30 * 60
+FX_RATE_CACHE_SIZE = 128
+
+# Seconds that a caller may hold the lease to web scrape a price or rate, before another caller may take over.
+SINGLE_FLIGHT_TIMEOUT = 30
+
+
 # Set context for decimal
 """ The significance of a new Decimal is determined solely by the number of digits input. 
     Context precision and rounding only come into play during arithmetic operations.    """
@@ -143,6 +165,59 @@ getcontext().prec = 10
 getcontext().traps[FloatOperation] = True
 getcontext().rounding = ROUND_HALF_EVEN
 
+# Maximum number of concurrent web scrapes when refreshing stale stock prices.
+QUOTE_REFRESH_MAX_WORKERS = 8
+
+# Outbound requests to web scrape prices and rates, which share a pool of kept alive connections.
+# (connect, read) timeouts in seconds, and the number of retries after the first attempt,
+# which back off for up to HTTP_RETRY_BACKOFF * 2 ** retry seconds.
+HTTP_TIMEOUT = (3.05, 10)
+HTTP_RETRIES = 2
+HTTP_RETRY_BACKOFF = 0.5
+HTTP_MAX_CONNECTIONS_PER_HOST = QUOTE_REFRESH_MAX_WORKERS
+# Bytes of a response left unread that are still read, so that its connection is kept alive.
+# Connections of responses with more left than this are dropped instead.
+HTTP_MAX_DRAIN_BYTES = 2 * 1024 * 1024
+# Requests to a host stop for HTTP_CIRCUIT_BREAKER_RESET_TIMEOUT seconds after this many consecutive failures.
+HTTP_CIRCUIT_BREAKER_THRESHOLD = 5
+HTTP_CIRCUIT_BREAKER_RESET_TIMEOUT = 60
+
+# Where stock prices and currency conversion rates are looked up from.
+# base.providers also has JsonFileProvider and SQLiteProvider (OPTIONS: {"path": ...}),
+# and FakeProvider, to benchmark and load test offline.
+MARKET_DATA_PROVIDERS = {
+    "quotes": {"BACKEND": "base.providers.GoogleFinanceQuoteProvider"},
+    "fx": {"BACKEND": "base.providers.XeFxProvider"},
+}
+
+# Seconds that the exchange a ticker is traded in is remembered for,
+# and seconds that a ticker is remembered to be invalid for.
+EXCHANGE_RESOLUTION_TTL = 30 * 24 * 60 * 60
+EXCHANGE_RESOLUTION_NEGATIVE_TTL = 60 * 60
+
+# Number of invalid tickers that each process remembers.
+INVALID_TICKER_CACHE_SIZE = 1024
+
+# Each user may look up this many new tickers per this many seconds.
+TICKER_LOOKUP_RATE_LIMIT = (10, 60)
+
+# Each user may import transactions in this many new tickers per this many seconds,
+# apart from the tickers they search for, as a single file may hold many of them.
+TICKER_IMPORT_RATE_LIMIT = (500, 3600)
+
+# Number of transactions or transfers on each page of the history.
+HISTORY_PAGE_SIZE = 50
+
+# Number of rows that history exports read from the database at a time.
+EXPORT_CHUNK_SIZE = 2000
+
+# Number of transactions that imports insert per query.
+IMPORT_BATCH_SIZE = 1000
+
+# Set to True when running `python manage.py refresh_quotes` alongside the server,
+# so that pages never web scrape prices while rendering.
+BACKGROUND_QUOTE_REFRESH = False
+
 # Since there is no alert-error class for alerts for messages, I changed the tags to danger instead.
 MESSAGE_TAGS = {message_constants.ERROR: "danger"}
 
@@ -5,6 +5,7 @@ from .models import (
     CurrencyConversionRate,
     OwnedStock,
     Stock,
+    TickerExchange,
     Transaction,
     Transfer,
     User,
@@ -41,4 +42,6 @@ class CustomUserAdmin(UserAdmin):
 
 
 admin.site.register(User, CustomUserAdmin)
-admin.site.register([Transaction, OwnedStock, Stock, Transfer, CurrencyConversionRate])
+admin.site.register(
+    [Transaction, OwnedStock, Stock, Transfer, CurrencyConversionRate, TickerExchange]
+)
@@ -0,0 +1,185 @@
+"""
+Portfolio analytics over the daily portfolio snapshots, computed with NumPy arrays.
+
+Precision: amounts are stored as Decimals with 2 decimal places, and are converted to
+float64 once, when they are read from the database. float64 holds 15 to 16 significant
+digits, which represents every amount of the DecimalFields (at most 14 digits) to the
+cent, whereas compounding 10 years of daily returns in the Decimal context of
+settings.py (prec = 10) would round at every one of the thousands of steps. Since
+returns, drawdowns and volatility are ratios that are only displayed, they are kept as
+floats and are never mixed with Decimal arithmetic (which traps FloatOperation).
+"""
+
+import math
+from datetime import date
+
+import numpy as np
+from django.db.models import Case, DecimalField, F, Sum, When
+from django.db.models.functions import TruncDate
+
+from .models import PortfolioSnapshot, Transaction, Transfer
+
+# Snapshots are taken every calendar day, including weekends.
+DAYS_PER_YEAR = 365
+
+
+def load_series(user_ids, start=None, end=None) -> dict:
+    """
+    Loads the snapshots of each user between start and end, with a fixed number of
+    queries however many users there are. Returns {user id: (days, navs, flows)}, where
+    days are date ordinals, navs are each day's net account value and flows are each
+    day's external cash flows into the portfolio, i.e. the net cash transferred in, plus
+    the cost of buys less the proceeds of sells, since trades do not move cash.
+    """
+    snapshots = PortfolioSnapshot.objects.filter(user_id__in=user_ids)
+    if start:
+        snapshots = snapshots.filter(date__gte=start)
+    if end:
+        snapshots = snapshots.filter(date__lte=end)
+
+    snapshots = snapshots.order_by("user_id", "date").values_list(
+        "user_id", "date", "nav"
+    )
+    rows = np.fromiter(
+        ((user_id, day.toordinal(), float(nav)) for user_id, day, nav in snapshots),
+        dtype=[("user", "i8"), ("day", "i8"), ("nav", "f8")],
+    )
+    if not len(rows):
+        return {}
+
+    transfer_flows = (
+        Transfer.objects.filter(user_id__in=user_ids)
+        .annotate(day=TruncDate("datetime"))
+        .values_list("user_id", "day")
+        .annotate(flow=Sum(F("new_cash") - F("old_cash")))
+    )
+    trade_flows = (
+        Transaction.objects.filter(user_id__in=user_ids)
+        .annotate(day=TruncDate("datetime"))
+        .values_list("user_id", "day")
+        .annotate(
+            flow=Sum(
+                Case(
+                    When(direction="buy", then=F("quantity") * F("unit_price")),
+                    default=-F("quantity") * F("unit_price"),
+                    output_field=DecimalField(),
+                )
+            )
+        )
+    )
+    flows = np.fromiter(
+        (
+            (user_id, day.toordinal(), float(flow))
+            for queryset in [transfer_flows, trade_flows]
+            for user_id, day, flow in queryset.order_by()
+        ),
+        dtype=[("user", "i8"), ("day", "i8"), ("flow", "f8")],
+    )
+    flows.sort(order=["user", "day"])
+
+    series = {}
+    users, starts = np.unique(rows["user"], return_index=True)
+    for user_id, user_rows in zip(users, np.split(rows, starts[1:])):
+        days = user_rows["day"]
+
+        # Only the flows of the user within the snapshotted days are part of the series.
+        first = np.searchsorted(flows["user"], user_id, side="left")
+        last = np.searchsorted(flows["user"], user_id, side="right")
+        user_flows = flows[first:last]
+        user_flows = user_flows[
+            (user_flows["day"] >= days[0]) & (user_flows["day"] <= days[-1])
+        ]
+
+        daily_flows = np.zeros(len(days))
+        np.add.at(
+            daily_flows, np.searchsorted(days, user_flows["day"]), user_flows["flow"]
+        )
+        series[int(user_id)] = (days, user_rows["nav"], daily_flows)
+
+    return series
+
+
+def daily_returns(navs, flows):
+    """
+    Returns each day's return, excluding the day's external cash flows, which are
+    assumed to arrive at the day's close. Days that start with nothing have no return.
+    """
+    previous = navs[:-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = (navs[1:] - flows[1:]) / previous - 1
+    return np.where(previous > 0, returns, 0.0)
+
+
+def money_weighted_return(days, navs, flows, tolerance=1e-10) -> float | None:
+    """
+    Returns the annualised internal rate of return of investing the first day's net
+    account value and each later day's flows, to end up with the last day's value,
+    found by bisection. Returns None if there is no such rate.
+    """
+    years = (days[-1] - days) / DAYS_PER_YEAR
+    amounts = flows.copy()
+    amounts[0] = navs[0]
+    invested = amounts != 0
+    years, amounts = years[invested], amounts[invested]
+
+    def surplus(log_growth):
+        # Value of the investments grown at the continuously compounded rate, less the
+        # final value. Solving for the log of growth keeps short periods from overflowing.
+        with np.errstate(over="ignore"):
+            return np.sum(amounts * np.exp(log_growth * years)) - navs[-1]
+
+    low, high = -50.0, 50.0
+    if surplus(low) * surplus(high) > 0:
+        return None
+
+    while high - low > tolerance:
+        middle = (low + high) / 2
+        if surplus(low) * surplus(middle) <= 0:
+            high = middle
+        else:
+            low = middle
+
+    return math.expm1((low + high) / 2)
+
+
+def analyse_series(days, navs, flows) -> dict:
+    """
+    Calculates the time-weighted return (total and annualised), money-weighted return
+    (annualised), maximum drawdown and annualised volatility of a series of snapshots.
+    """
+    returns = daily_returns(navs, flows)
+    growth = np.cumprod(1 + returns)
+    years = float(days[-1] - days[0]) / DAYS_PER_YEAR
+
+    twr = float(growth[-1] - 1) if len(growth) else 0.0
+    peaks = np.maximum.accumulate(np.concatenate(([1.0], growth)))[1:]
+    max_drawdown = float(-np.min(growth / peaks - 1, initial=0.0))
+
+    return {
+        "start": date.fromordinal(int(days[0])),
+        "end": date.fromordinal(int(days[-1])),
+        "twr": twr,
+        "annualised_twr": (
+            (1 + twr) ** (1 / years) - 1 if years > 0 and twr > -1 else None
+        ),
+        "mwr": money_weighted_return(days, navs, flows) if years > 0 else None,
+        "max_drawdown": max_drawdown,
+        "volatility": (
+            float(np.std(returns, ddof=1)) * math.sqrt(DAYS_PER_YEAR)
+            if len(returns) > 1
+            else None
+        ),
+    }
+
+
+def analyse_users(user_ids, start=None, end=None) -> dict:
+    """Analyses the snapshots of each user, returning {user id: analytics}."""
+    return {
+        user_id: analyse_series(*series)
+        for user_id, series in load_series(user_ids, start, end).items()
+    }
+
+
+def analyse(user, start=None, end=None) -> dict | None:
+    """Analyses the user's snapshots, or returns None if they have none."""
+    return analyse_users([user.pk], start, end).get(user.pk)
@@ -0,0 +1,79 @@
+import csv
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Transaction, Transfer
+
+# The columns of each kind of history that can be exported.
+EXPORTS = {
+    "transactions": (
+        Transaction,
+        [
+            ("id", "id"),
+            ("datetime", "datetime"),
+            ("ticker", "owned_stock__stock__ticker"),
+            ("direction", "direction"),
+            ("quantity", "quantity"),
+            ("unit_price", "unit_price"),
+        ],
+    ),
+    "transfers": (
+        Transfer,
+        [
+            ("id", "id"),
+            ("datetime", "datetime"),
+            ("method", "method"),
+            ("value", "value"),
+            ("old_cash", "old_cash"),
+            ("new_cash", "new_cash"),
+        ],
+    ),
+}
+
+FORMATS = {"csv": "text/csv", "json": "application/json"}
+
+
+class Echo:
+    """A file-like object that returns what is written to it, instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(user, kind: str, chunk_size: int | None = None):
+    """
+    Returns the column names of the user's history of kind ("transactions" or
+    "transfers"), and an iterator over its rows, earliest first, which reads them from
+    the database chunk_size rows at a time (settings.EXPORT_CHUNK_SIZE by default).
+    """
+    model, columns = EXPORTS[kind]
+    rows = (
+        model.objects.filter(user=user)
+        .order_by("datetime", "id")
+        .values_list(*[lookup for name, lookup in columns])
+        .iterator(chunk_size=chunk_size or settings.EXPORT_CHUNK_SIZE)
+    )
+    return [name for name, lookup in columns], rows
+
+
+def stream_export(user, kind: str, format: str, chunk_size: int | None = None):
+    """
+    Yields the user's history of kind as CSV or JSON text, a row at a time, so that
+    exports of any size are written in constant memory.
+    """
+    header, rows = export_rows(user, kind, chunk_size)
+
+    if format == "csv":
+        writer = csv.writer(Echo())
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+        return
+
+    yield "["
+    for i, row in enumerate(rows):
+        separator = ",\n" if i else "\n"
+        yield separator + json.dumps(dict(zip(header, row)), cls=DjangoJSONEncoder)
+    yield "\n]\n"
@@ -0,0 +1,68 @@
+import codecs
+from html.parser import HTMLParser
+
+
+class ElementTextParser(HTMLParser):
+    """
+    Collects the text of the first tag element that has all of the given classes,
+    without building a tree of the page. Sets done once the element ends, after
+    which the rest of the page does not need to be fed.
+    """
+
+    def __init__(self, tag: str, class_: str):
+        super().__init__(convert_charrefs=True)
+        self.tag = tag
+        self.classes = set(class_.split())
+        self.depth = 0
+        self.text = []
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag != self.tag or self.done:
+            return
+
+        if self.depth:
+            # A nested element of the same tag.
+            self.depth += 1
+            return
+
+        for name, value in attrs:
+            if name == "class" and value and self.classes <= set(value.split()):
+                self.depth = 1
+                return
+
+    def handle_endtag(self, tag):
+        if tag == self.tag and self.depth:
+            self.depth -= 1
+            if not self.depth:
+                self.done = True
+
+    def handle_data(self, data):
+        if self.depth:
+            self.text.append(data)
+
+
+def find_text(html, tag: str, class_: str) -> str | None:
+    """
+    Returns the text of the first tag element with the classes in class_ (a space
+    separated string, like BeautifulSoup's class_), or None if there is no such element.
+
+    html is either a string or an iterable of str or bytes chunks, such as a streamed
+    response's iter_content(). Parsing, and reading chunks, stops as soon as the
+    element ends.
+    """
+    parser = ElementTextParser(tag, class_)
+    chunks = [html] if isinstance(html, str) else html
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    for chunk in chunks:
+        parser.feed(decoder.decode(chunk) if isinstance(chunk, bytes) else chunk)
+        if parser.done:
+            break
+    else:
+        parser.close()
+
+    if not parser.done and not parser.depth:
+        return None
+
+    return "".join(parser.text)
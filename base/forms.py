@@ -84,6 +84,13 @@ class TransactionForm(BaseModelForm):
         }
 
 
+class ImportTransactionsForm(BaseForm):
+    file = forms.FileField(
+        label="CSV file",
+        help_text="With the columns ticker, datetime, direction, quantity and unit_price.",
+    )
+
+
 class TransferForm(BaseModelForm):
     class Meta:
         model = Transfer
@@ -0,0 +1,112 @@
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .cache import LRUCache
+from .models import CurrencyConversionRate
+
+
+class FxRateCache:
+    """
+    Serves currency conversion rates from a per-process LRU cache, backed by Django's
+    cache framework so that every worker process shares the same rates, before falling
+    back to the database.
+
+    Rates older than ttl seconds are still served, while they are refreshed in a
+    background thread, so rendering never waits on web scraping a rate that was cached.
+    """
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.local = LRUCache(maxsize=maxsize)
+        self.ttl = ttl
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        self.counts = dict.fromkeys(
+            ["local_hits", "shared_hits", "misses", "stale", "refreshes"], 0
+        )
+
+    @staticmethod
+    def key(cfrom: str, cto: str) -> str:
+        return f"fx:{cfrom}:{cto}"
+
+    def count(self, name: str):
+        with self.lock:
+            self.counts[name] += 1
+
+    def get_rate(self, cfrom: str, cto: str) -> Decimal:
+        key = self.key(cfrom, cto)
+
+        entry = self.local.get(key)
+        if entry is not None:
+            self.count("local_hits")
+        else:
+            entry = cache.get(key)
+            if entry is None:
+                self.count("misses")
+                return self.refresh(cfrom, cto)
+
+            self.count("shared_hits")
+            self.local.set(key, entry)
+
+        rate, refreshed_at = entry
+        if time.time() - refreshed_at >= self.ttl:
+            self.count("stale")
+            self.refresh_async(cfrom, cto)
+
+        return rate
+
+    def refresh(self, cfrom: str, cto: str) -> Decimal:
+        """Loads the rate from the database, which web scrapes it if it is outdated, and caches it."""
+        self.count("refreshes")
+        conversion_object, created = CurrencyConversionRate.objects.get_or_create(
+            cfrom=cfrom, cto=cto
+        )
+        rate = conversion_object.ccrate
+
+        # Do not cache a rate that failed to be web scraped, so that it is retried.
+        if rate:
+            entry = (rate, time.time())
+            cache.set(self.key(cfrom, cto), entry, timeout=None)
+            self.local.set(self.key(cfrom, cto), entry)
+
+        return rate
+
+    def refresh_async(self, cfrom: str, cto: str):
+        key = self.key(cfrom, cto)
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+
+        def run():
+            try:
+                self.refresh(cfrom, cto)
+            except Exception as e:
+                print(f"Failed to refresh rate {cfrom}{cto}: {e}")
+            finally:
+                # Each thread has its own database connection, which has to be closed.
+                connection.close()
+                with self.lock:
+                    self.refreshing.discard(key)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def clear(self):
+        self.local.clear()
+        with self.lock:
+            self.counts = dict.fromkeys(self.counts, 0)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {**self.counts, "size": len(self.local)}
+
+
+fx_rates = FxRateCache(maxsize=settings.FX_RATE_CACHE_SIZE, ttl=settings.FX_RATE_TTL)
+
+
+def get_rate(cfrom: str, cto: str) -> Decimal:
+    return fx_rates.get_rate(cfrom, cto)
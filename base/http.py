@@ -0,0 +1,183 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+# Statuses that are worth retrying, since the upstream may recover from them.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of sending a request to a host that has been failing."""
+
+
+class CircuitBreaker:
+    """
+    Opens after threshold consecutive failures, so that requests to a failing host
+    fail fast instead of tying up workers. After reset_timeout seconds, a single
+    request is let through, which closes the circuit again if it succeeds.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Half open, let this request through and hold off any others.
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def succeeded(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failed(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class HttpClient:
+    """
+    A thread-safe HTTP client shared by every outbound fetch, which keeps connections
+    alive in a pool, limits the number of concurrent requests to each host, times out
+    hung requests, retries failures with jittered exponential backoff, and stops
+    sending requests to a host that keeps failing.
+    """
+
+    def __init__(
+        self,
+        timeout: tuple[float, float],
+        retries: int,
+        backoff: float,
+        max_per_host: int,
+        breaker_threshold: int,
+        breaker_reset_timeout: float,
+        max_drain: int,
+    ):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_per_host = max_per_host
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset_timeout = breaker_reset_timeout
+        self.max_drain = max_drain
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=max_per_host)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.semaphores = {}
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def host_limits(self, host: str):
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+                self.breakers[host] = CircuitBreaker(
+                    self.breaker_threshold, self.breaker_reset_timeout
+                )
+            return self.semaphores[host], self.breakers[host]
+
+    def sleep_before_retry(self, attempt: int):
+        # Full jitter, so that callers that failed together do not retry together.
+        time.sleep(random.uniform(0, self.backoff * 2**attempt))
+
+    def drain(self, response):
+        """
+        Reads the rest of a response that was not read to the end, so that closing it
+        returns its connection to the pool, instead of dropping it. Gives up, and lets the
+        connection be dropped, if more than max_drain bytes are left.
+        """
+        drained = 0
+        try:
+            for chunk in response.iter_content(64 * 1024):
+                drained += len(chunk)
+                if drained > self.max_drain:
+                    return
+        except requests.RequestException:
+            # The connection is dropped, as it would have been without draining.
+            return
+
+    @contextmanager
+    def get(self, url: str, **kwargs):
+        """
+        Streams a GET response, holding one of the host's connection slots until the
+        response is closed. The response does not have to be read to the end for its
+        connection to be reused. Raises requests.RequestException if every attempt failed.
+        """
+        semaphore, breaker = self.host_limits(urlsplit(url).netloc)
+        kwargs.setdefault("timeout", self.timeout)
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.sleep_before_retry(attempt - 1)
+
+            if not breaker.allow():
+                raise CircuitOpenError(
+                    f"Not requesting {url}, as its host keeps failing."
+                )
+
+            # Waits for a slot for no longer than a request may take to respond.
+            if not semaphore.acquire(timeout=self.timeout[1]):
+                raise requests.Timeout(f"Timed out waiting to request {url}.")
+
+            try:
+                response = self.session.get(url, stream=True, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                semaphore.release()
+                breaker.failed()
+                if attempt == self.retries:
+                    raise
+                print(f"Retrying {url} after {e}")
+                continue
+            except BaseException:
+                # Not worth retrying, but the slot still has to be given back.
+                semaphore.release()
+                raise
+
+            if response.status_code not in RETRY_STATUSES:
+                breaker.succeeded()
+                break
+
+            breaker.failed()
+            if attempt == self.retries:
+                break
+            print(f"Retrying {url} after status {response.status_code}.")
+            response.close()
+            semaphore.release()
+
+        try:
+            with response:  # type: ignore
+                yield response  # type: ignore
+                self.drain(response)
+        finally:
+            semaphore.release()
+
+
+client = HttpClient(
+    timeout=settings.HTTP_TIMEOUT,
+    retries=settings.HTTP_RETRIES,
+    backoff=settings.HTTP_RETRY_BACKOFF,
+    max_per_host=settings.HTTP_MAX_CONNECTIONS_PER_HOST,
+    breaker_threshold=settings.HTTP_CIRCUIT_BREAKER_THRESHOLD,
+    breaker_reset_timeout=settings.HTTP_CIRCUIT_BREAKER_RESET_TIMEOUT,
+    max_drain=settings.HTTP_MAX_DRAIN_BYTES,
+)
@@ -0,0 +1,114 @@
+import csv
+import io
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+
+from .forms import TransactionForm
+from .models import DailyPrice, JournalEvent, OwnedStock, Stock, Transaction
+from .search import look_up_stock
+
+# Columns that an imported CSV file must have, the same as those of a transaction export.
+COLUMNS = ["ticker", "datetime", "direction", "quantity", "unit_price"]
+
+
+def import_transactions(user, file) -> tuple[int, list[str]]:
+    """
+    Imports the transactions in a CSV file (text or binary) with the columns in COLUMNS,
+    such as an export from this or another account, for the user.
+
+    Every row is validated before any transaction is saved, and each unique ticker is
+    looked up once. The stocks of valid new tickers are saved even if the import is
+    rejected, so that importing the corrected file does not look them up again. The
+    transactions are then inserted with bulk_create and each holding that they belong
+    to is rebuilt once, all in a single database transaction, so either every row is
+    imported or none is, with the holdings locked.
+
+    Returns the number of imported transactions and a list of errors, if any.
+    """
+    if isinstance(file.read(0), bytes):
+        file = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+
+    reader = csv.DictReader(file)
+    missing = [column for column in COLUMNS if column not in (reader.fieldnames or [])]
+    if missing:
+        return 0, [f"The file is missing the columns: {', '.join(missing)}."]
+
+    rows = []
+    errors = []
+    for line, row in enumerate(reader, start=2):
+        form = TransactionForm(row)
+        ticker = (row["ticker"] or "").strip().upper()
+
+        if not form.is_valid():
+            for field, field_errors in form.errors.items():
+                errors.append(f"Line {line}: {field}: {' '.join(field_errors)}")
+        elif not ticker:
+            errors.append(f"Line {line}: ticker: This field is required.")
+        elif len(ticker) > Stock._meta.get_field("ticker").max_length:  # type: ignore
+            errors.append(f"Line {line}: ticker: {ticker} is invalid.")
+        else:
+            rows.append((line, ticker, form.cleaned_data))
+
+    # One lookup per unique ticker. New tickers are looked up as searching for them
+    # would be, so they are rate limited per user (by their own limit for imports),
+    # and invalid ones are remembered.
+    tickers = list(dict.fromkeys(ticker for line, ticker, data in rows))
+    stocks = Stock.objects.in_bulk(tickers, field_name="ticker")
+    new_stocks = []
+    ticker_errors = {}
+    for ticker in tickers:
+        if ticker in stocks:
+            continue
+
+        stock, error = look_up_stock(user, ticker, imported=True)
+        if stock:
+            stocks[ticker] = stock
+            new_stocks.append(stock)
+        else:
+            ticker_errors[ticker] = error
+
+    for line, ticker, data in rows:
+        if ticker in ticker_errors:
+            errors.append(f"Line {line}: ticker: {ticker}: {ticker_errors[ticker]}")
+
+    with db_transaction.atomic():
+        Stock.objects.bulk_create(new_stocks)
+        DailyPrice.objects.record(new_stocks)
+
+    if errors:
+        return 0, errors
+
+    with db_transaction.atomic():
+        # Lock the holdings, so that trades booked meanwhile wait for the import.
+        owned_stocks = {
+            owned_stock.stock_id: owned_stock  # type: ignore
+            for owned_stock in OwnedStock.objects.filter(
+                user=user, stock__in=stocks.values()
+            ).lock()
+        }
+        for stock in stocks.values():
+            if stock.pk not in owned_stocks:
+                owned_stocks[stock.pk] = OwnedStock.objects.lock_or_create(user, stock)
+
+        transactions = Transaction.objects.bulk_create(
+            [
+                Transaction(
+                    user=user,
+                    owned_stock=owned_stocks[stocks[ticker].pk],
+                    **data,
+                )
+                for line, ticker, data in rows
+            ],
+            batch_size=settings.IMPORT_BATCH_SIZE,
+        )
+        JournalEvent.objects.bulk_create(
+            [JournalEvent.trade(transaction) for transaction in transactions],
+            batch_size=settings.IMPORT_BATCH_SIZE,
+        )
+
+        # Rebuild each holding once, after all of its transactions are in.
+        for owned_stock in owned_stocks.values():
+            owned_stock.update_instance()
+
+    return len(rows), []
@@ -0,0 +1,219 @@
+"""
+Rebuilds users' positions and cash from the append-only journal of events.
+
+The journal is the source of truth: every booked or deleted trade and every transfer
+appends a JournalEvent in the same database transaction that updates the holdings and
+cash, which are read models that can be regenerated from it at any time.
+
+Rebuilding starts from the user's latest JournalSnapshot and replays only the events
+after it. Trades are applied to each stock's FifoBook as they come, unless one is
+back-dated before a trade that was already applied, or a trade is deleted, in which
+case the trades of that stock are replayed from its first event, in (datetime, id)
+order, since either changes which lots every later sell consumed.
+
+The journal records what changed a user's positions and cash, not an audit log of every
+write to the read models. Recalculating holdings from their transactions (update_instance()
+or the rebuild_positions command) or regenerating them from the journal (regenerate())
+records no event, since it only derives again what the recorded events already determine.
+"""
+
+from datetime import datetime
+from decimal import Decimal
+
+from django.db import transaction as db_transaction
+
+from .models import JournalEvent, JournalSnapshot, OwnedStock, User
+from .positions import FifoBook
+
+
+def trade_order(payload) -> tuple:
+    """Orders trades as the holdings do, by datetime and then by id."""
+    return datetime.fromisoformat(payload["datetime"]), payload["id"]
+
+
+class Position:
+    """A stock's FifoBook, and the (datetime, id) of the last trade applied to it."""
+
+    def __init__(self, book: FifoBook | None = None, last: tuple | None = None):
+        self.book = book or FifoBook()
+        self.last = last
+
+    def apply(self, payload) -> bool:
+        """
+        Applies a trade, unless it is ordered before the last one applied.
+        Returns whether it was applied.
+        """
+        key = trade_order(payload)
+        if self.last is not None and key < self.last:
+            return False
+
+        self.book.apply(
+            payload["id"],
+            payload["direction"],
+            Decimal(payload["quantity"]),
+            Decimal(payload["unit_price"]),
+        )
+        self.last = key
+        return True
+
+    def to_state(self) -> dict:
+        return {
+            "lots": self.book.open_lots(),
+            "oversold": list(self.book.oversold),
+            "realised_pnl": self.book.realised_pnl,
+            "last": [self.last[0].isoformat(), self.last[1]] if self.last else None,
+        }
+
+    @classmethod
+    def from_state(cls, state) -> "Position":
+        book = FifoBook(
+            [
+                [key, Decimal(quantity), Decimal(unit_price)]
+                for key, quantity, unit_price in state["lots"]
+            ],
+            [[key, Decimal(uncovered)] for key, uncovered in state["oversold"]],
+            Decimal(state["realised_pnl"]),
+        )
+        last = state["last"]
+        return cls(book, (datetime.fromisoformat(last[0]), last[1]) if last else None)
+
+
+def replay_stock(user, stock_id, until) -> Position:
+    """Replays all of the user's trades in the stock, up to the event until, afresh."""
+    events = JournalEvent.objects.filter(
+        user=user,
+        stock_id=stock_id,
+        kind__in=[JournalEvent.TRADE, JournalEvent.TRADE_DELETED],
+        id__lte=until,
+    ).values_list("kind", "payload")
+
+    trades = {}
+    deleted = set()
+    for kind, payload in events.iterator():
+        if kind == JournalEvent.TRADE:
+            trades[payload["id"]] = payload
+        else:
+            deleted.add(payload["id"])
+
+    position = Position()
+    remaining = [payload for id, payload in trades.items() if id not in deleted]
+    remaining.sort(key=trade_order)
+    for payload in remaining:
+        position.apply(payload)
+    return position
+
+
+def rebuild(user) -> tuple[Decimal, dict, int]:
+    """
+    Rebuilds the user's positions and cash from their latest journal snapshot and the
+    events after it. Returns (cash, {stock id: Position}, id of the last event).
+    """
+    snapshot = (
+        JournalSnapshot.objects.filter(user=user).order_by("-last_event_id").first()
+    )
+    if snapshot:
+        cash = Decimal(snapshot.state["cash"])
+        positions = {
+            int(stock_id): Position.from_state(state)
+            for stock_id, state in snapshot.state["positions"].items()
+        }
+        last_event_id = snapshot.last_event_id
+    else:
+        cash = Decimal()
+        positions = {}
+        last_event_id = 0
+
+    stale = set()
+    events = JournalEvent.objects.filter(user=user, id__gt=last_event_id).values_list(
+        "id", "kind", "stock_id", "payload"
+    )
+    for id, kind, stock_id, payload in events.iterator():
+        last_event_id = id
+        if kind == JournalEvent.TRANSFER:
+            cash = Decimal(payload["new_cash"])
+        elif kind == JournalEvent.CORRECTION:
+            cash = Decimal(payload["cash"])
+        elif kind == JournalEvent.TRADE_DELETED:
+            stale.add(stock_id)
+        elif stock_id not in stale:
+            position = positions.setdefault(stock_id, Position())
+            if not position.apply(payload):
+                stale.add(stock_id)
+
+    for stock_id in stale:
+        positions[stock_id] = replay_stock(user, stock_id, last_event_id)
+
+    return cash, positions, last_event_id
+
+
+def take_snapshot(user) -> JournalSnapshot:
+    """Saves the user's rebuilt positions and cash as of their last journal event."""
+    cash, positions, last_event_id = rebuild(user)
+    return JournalSnapshot.objects.create(
+        user=user,
+        last_event_id=last_event_id,
+        state={
+            "cash": cash,
+            "positions": {
+                stock_id: position.to_state()
+                for stock_id, position in positions.items()
+            },
+        },
+    )
+
+
+def stored_position(owned_stock) -> list[Decimal]:
+    """Returns the position fields of a holding, rounded as they are stored."""
+    return [
+        (getattr(owned_stock, name) or Decimal()).quantize(
+            Decimal(10) ** -OwnedStock._meta.get_field(name).decimal_places  # type: ignore
+        )
+        for name in OwnedStock.POSITION_FIELDS
+    ]
+
+
+def regenerate(user, save=True) -> list[str]:
+    """
+    Rebuilds the user's positions and cash from the journal and compares them with their
+    cash and holdings. Returns a description of each difference, and, if save is True,
+    overwrites the cash and holdings with the rebuilt values.
+
+    The holdings' lots are not regenerated, since they are derived from the transactions
+    (see OwnedStock.update_instance).
+    """
+    differences = []
+    with db_transaction.atomic():
+        owned_stocks = (
+            OwnedStock.objects.filter(user=user).select_related("stock").lock()
+        )
+        cash, positions, last_event_id = rebuild(user)
+
+        current_cash = User.objects.values_list("cash", flat=True).get(pk=user.pk)
+        if current_cash != cash:
+            differences.append(f"cash: {current_cash} instead of {cash}")
+            if save:
+                User.objects.filter(pk=user.pk).update(cash=cash)
+
+        changed = []
+        for owned_stock in owned_stocks:
+            position = positions.get(owned_stock.stock_id, Position())  # type: ignore
+            current = stored_position(owned_stock)
+            owned_stock.set_position(position.book)
+            rebuilt = stored_position(owned_stock)
+            if current != rebuilt:
+                differences.append(
+                    f"{owned_stock.stock.ticker}: "
+                    + ", ".join(
+                        f"{field} {old} instead of {new}"
+                        for field, old, new in zip(
+                            OwnedStock.POSITION_FIELDS, current, rebuilt
+                        )
+                        if old != new
+                    )
+                )
+                changed.append(owned_stock)
+
+        if save:
+            OwnedStock.objects.bulk_update(changed, OwnedStock.POSITION_FIELDS)
+
+    return differences
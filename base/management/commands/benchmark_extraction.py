@@ -0,0 +1,92 @@
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+from django.core.management.base import BaseCommand, CommandError
+
+from base.extract import find_text
+from base.providers import CHUNK_SIZE
+
+
+def synthetic_page(size: int) -> str:
+    """Makes up a quote page of about size bytes, with the latest price in the middle."""
+    filler = (
+        '<div class="gyFHrc"><span class="mfs7Fc">Previous close</span>'
+        '<div class="P6K39c">$189.50</div></div>\n'
+    )
+    half = filler * (size // len(filler) // 2)
+    return (
+        f"<html><head><title>Quote</title></head><body>{half}"
+        '<div class="rPF6Lc"><div class="YMlKec fxKbKc">$189.84</div></div>'
+        f"{half}</body></html>"
+    )
+
+
+def beautiful_soup(html, tag, class_):
+    element = BeautifulSoup(html, "html.parser").find(tag, class_=class_)
+    return element.text if element else None  # type: ignore
+
+
+def streamed(html, tag, class_):
+    return find_text(
+        (html[i : i + CHUNK_SIZE] for i in range(0, len(html), CHUNK_SIZE)), tag, class_
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the CPU time and peak memory of finding the latest price in a quote "
+        "page with BeautifulSoup against the streaming extractor that the providers use."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "paths",
+            nargs="*",
+            help="Saved quote pages to parse. A synthetic page is used if none are given.",
+        )
+        parser.add_argument("--tag", default="div")
+        parser.add_argument("--class", dest="class_", default="YMlKec fxKbKc")
+        parser.add_argument(
+            "--size",
+            type=int,
+            default=1024 * 1024,
+            help="Size in bytes of the synthetic page.",
+        )
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        pages = []
+        try:
+            for path in options["paths"]:
+                with open(path, encoding="utf-8", errors="replace") as file:
+                    pages.append(file.read())
+        except OSError as e:
+            raise CommandError(e)
+
+        if not pages:
+            pages.append(synthetic_page(options["size"]))
+
+        for name, extract in [
+            ("BeautifulSoup", beautiful_soup),
+            ("Streaming", streamed),
+        ]:
+            results = set()
+
+            start = time.process_time()
+            for _ in range(options["repeat"]):
+                for html in pages:
+                    results.add(extract(html, options["tag"], options["class_"]))
+            cpu_time = (time.process_time() - start) / (options["repeat"] * len(pages))
+
+            # Measured separately, since tracing allocations slows parsing down.
+            tracemalloc.start()
+            for html in pages:
+                extract(html, options["tag"], options["class_"])
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            self.stdout.write(
+                f"{name}: {cpu_time * 1000:.2f} ms CPU time and {peak / 1024:.0f} KiB peak "
+                f"memory per quote, found {sorted(map(str, results))}."
+            )
@@ -0,0 +1,211 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+from itertools import islice
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+
+from base.models import Lot, OwnedStock, Stock, Transaction, Transfer, User
+from base.pagination import after_cursor
+
+# Rows inserted per query while seeding.
+SEED_BATCH_SIZE = 5000
+
+
+def seed(users, transactions, stocks, stdout):
+    """
+    Fills the database with users who each hold about 10 stocks, traded over 10 years
+    so that most lots are closed, and who made a transfer a month.
+    """
+    random.seed(0)
+    now = timezone.now()
+    stock_list = Stock.objects.bulk_create(
+        Stock(ticker=f"S{i:04}", exchange="NYSE", _price=Decimal("100"))
+        for i in range(stocks)
+    )
+    user_list = User.objects.bulk_create(
+        User(username=f"user{i}", email=f"user{i}@example.com") for i in range(users)
+    )
+    owned_stocks = OwnedStock.objects.bulk_create(
+        [
+            OwnedStock(
+                user=user,
+                stock=stock,
+                # About half of the holdings were sold off.
+                current_quantity=Decimal(random.choice([0, random.randint(1, 100)])),
+                average_cost_price=Decimal("100"),
+            )
+            for user in user_list
+            for stock in random.sample(stock_list, min(10, stocks))
+        ],
+        batch_size=SEED_BATCH_SIZE,
+    )
+
+    # The first holding is a heavy trader's, with a twentieth of all transactions.
+    heavy = transactions // 20
+    per_holding = max((transactions - heavy) // max(len(owned_stocks) - 1, 1), 1)
+    counts = [max(heavy, per_holding)] + [per_holding] * (len(owned_stocks) - 1)
+    rows = (
+        Transaction(
+            user_id=owned_stock.user_id,
+            owned_stock=owned_stock,
+            datetime=now - timedelta(minutes=minutes),
+            unit_price=Decimal(random.randint(100, 20000)) / 100,
+            quantity=Decimal(random.randint(1, 1000)) / 100,
+            direction=random.choice(["buy", "buy", "sell"]),
+        )
+        for owned_stock, count in zip(owned_stocks, counts)
+        for minutes in sorted(random.sample(range(60 * 24 * 3650), count))
+    )
+    while batch := Transaction.objects.bulk_create(list(islice(rows, SEED_BATCH_SIZE))):
+        Lot.objects.bulk_create(
+            Lot(
+                transaction_id=row.id,
+                owned_stock_id=row.owned_stock_id,
+                datetime=row.datetime,
+                unit_price=row.unit_price,
+                quantity=row.quantity,
+                # Most lots were sold long ago.
+                remaining_quantity=row.quantity if random.random() < 0.05 else 0,
+            )
+            for row in batch
+            if row.direction == "buy"
+        )
+
+    Transfer.objects.bulk_create(
+        [
+            Transfer(
+                user=user,
+                method="deposit",
+                value=Decimal("1000"),
+                old_cash=Decimal(1000 * month),
+                new_cash=Decimal(1000 * (month + 1)),
+                datetime=now - timedelta(days=30 * month),
+            )
+            for user in user_list
+            for month in range(120)
+        ],
+        batch_size=SEED_BATCH_SIZE,
+    )
+    stdout.write(
+        f"Seeded {Transaction.objects.count()} transactions, "
+        f"{Lot.objects.count()} lots and {len(owned_stocks)} holdings of {users} users."
+    )
+
+
+def hot_queries() -> dict:
+    """The hot paths' queries, for the holding with most transactions and its user."""
+    owned_stock = (
+        OwnedStock.objects.annotate(transactions=Count("transaction"))
+        .order_by("-transactions")
+        .first()
+    )
+    user = owned_stock.user  # type: ignore
+    transactions = owned_stock.transaction_set  # type: ignore
+
+    # The history is benchmarked on its second page.
+    page_size = settings.HISTORY_PAGE_SIZE
+    latest = user.transaction_set.order_by("-datetime", "-id")[page_size]
+    cursor = f"{latest.datetime.isoformat()}_{latest.id}"
+
+    return {
+        # The home page.
+        "Open positions": user.get_holdings(),
+        # Booking a transaction.
+        "Holding lookup": OwnedStock.objects.filter(
+            user=user, stock=owned_stock.stock  # type: ignore
+        ),
+        "Latest transaction": transactions.order_by("-datetime", "-id")[:1],
+        "Open lot scan": owned_stock.lot_set.filter(  # type: ignore
+            remaining_quantity__gt=0
+        )
+        .order_by("datetime", "transaction_id")
+        .values_list("transaction_id", "remaining_quantity", "unit_price"),
+        # OwnedStock.update_instance() and the rebuild_positions command.
+        "Holding replay": transactions.order_by("datetime", "id").values_list(
+            "id", "direction", "quantity", "unit_price", "datetime"
+        ),
+        # The history page.
+        "Transaction history": after_cursor(
+            user.transaction_set.select_related("owned_stock__stock"), cursor
+        )[: page_size + 1],
+        "Transfer history": after_cursor(user.transfer_set.all(), cursor)[
+            : page_size + 1
+        ],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a separate test database and shows the query plans and timings of the "
+        "hot queries without and then with the indexes declared in the models' "
+        "Meta.indexes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--transactions", type=int, default=1_000_000)
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--stocks", type=int, default=100)
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=20,
+            help="Number of times each query is timed, of which the median is shown.",
+        )
+
+    def handle(self, *args, **options):
+        # Never touch the real database: the seeded data and dropped indexes only exist
+        # in the test database, which is destroyed afterwards.
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            start = time.monotonic()
+            seed(
+                options["users"],
+                options["transactions"],
+                options["stocks"],
+                self.stdout,
+            )
+            self.stdout.write(f"Seeding took {time.monotonic() - start:.1f} seconds.")
+
+            indexes = [
+                (model, index)
+                for model in apps.get_app_config("base").get_models()
+                for index in model._meta.indexes
+            ]
+            with connection.schema_editor() as schema_editor:
+                for model, index in indexes:
+                    schema_editor.remove_index(model, index)
+            self.benchmark("Without the indexes", options["repeat"])
+
+            with connection.schema_editor() as schema_editor:
+                for model, index in indexes:
+                    schema_editor.add_index(model, index)
+            self.benchmark("With the indexes", options["repeat"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def benchmark(self, title, repeat):
+        # Refresh the planner's statistics, as after a real migration and some use.
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n{title}:"))
+        for name, queryset in hot_queries().items():
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append(time.perf_counter() - start)
+
+            plan = queryset.explain().replace("\n", "\n    ")
+            self.stdout.write(
+                f"{name}: {statistics.median(timings) * 1000:.2f} ms\n    {plan}"
+            )
@@ -0,0 +1,38 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from base.models import CurrencyConversionRate, Stock
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes the stock prices and currency conversion rates in the database to a "
+        "JSON file, which JsonFileProvider can serve offline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Path of the JSON file to write.")
+
+    def handle(self, *args, **options):
+        data = {
+            "quotes": {
+                f"{ticker}:{exchange}": str(price)
+                for ticker, exchange, price in Stock.objects.exclude(
+                    exchange=None
+                ).values_list("ticker", "exchange", "_price")
+            },
+            "rates": {
+                f"{cfrom}:{cto}": str(rate)
+                for cfrom, cto, rate in CurrencyConversionRate.objects.values_list(
+                    "cfrom", "cto", "_ccrate"
+                )
+            },
+        }
+
+        with open(options["path"], "w") as file:
+            json.dump(data, file, indent=2)
+
+        self.stdout.write(
+            f"Wrote {len(data['quotes'])} prices and {len(data['rates'])} rates to {options['path']}."
+        )
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from base.export import EXPORTS, FORMATS, stream_export
+from base.models import User
+
+
+class Command(BaseCommand):
+    help = "Writes a user's transaction or transfer history as CSV or JSON, a row at a time."
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument("kind", choices=list(EXPORTS))
+        parser.add_argument("--format", choices=list(FORMATS), default="csv")
+        parser.add_argument(
+            "--output", help="Path of the file to write. Defaults to stdout."
+        )
+        parser.add_argument("--chunk-size", type=int)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"].lower())
+        except User.DoesNotExist:
+            raise CommandError(f"There is no user {options['username']}.")
+
+        lines = stream_export(
+            user, options["kind"], options["format"], options["chunk_size"]
+        )
+
+        if not options["output"]:
+            for line in lines:
+                self.stdout.write(line, ending="")
+            return
+
+        with open(options["output"], "w", newline="") as file:
+            file.writelines(lines)
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from base.imports import COLUMNS, import_transactions
+from base.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports a user's transactions from a CSV file with the columns "
+        f"{', '.join(COLUMNS)}, rebuilding each holding once at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument("path", help="Path of the CSV file to import.")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"].lower())
+        except User.DoesNotExist:
+            raise CommandError(f"There is no user {options['username']}.")
+
+        try:
+            with open(options["path"], newline="", encoding="utf-8-sig") as file:
+                count, errors = import_transactions(user, file)
+        except OSError as e:
+            raise CommandError(e)
+
+        if errors:
+            raise CommandError("No transactions were imported.\n" + "\n".join(errors))
+
+        self.stdout.write(f"Imported {count} transactions.")
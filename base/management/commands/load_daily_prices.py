@@ -0,0 +1,57 @@
+import csv
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+
+from base.models import DailyPrice, Stock
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfills the closing prices of stocks from a CSV file with ticker, date "
+        "(YYYY-MM-DD) and close columns. Tickers that are not in the database are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Path of the CSV file of closing prices.")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["path"], newline="") as file:
+                rows = list(csv.reader(file))
+        except OSError as e:
+            raise CommandError(e)
+
+        tickers = {row[0].strip().upper() for row in rows if row}
+        stock_ids = dict(
+            Stock.objects.filter(ticker__in=tickers).values_list("ticker", "id")
+        )
+
+        closes = {}
+        for row in rows:
+            if len(row) < 3 or row[0].strip().upper() not in stock_ids:
+                continue
+            try:
+                day = date.fromisoformat(row[1].strip())
+                close = Decimal(row[2].strip())
+            except (ValueError, InvalidOperation):
+                # Skips the header, and malformed rows.
+                continue
+            closes[(stock_ids[row[0].strip().upper()], day)] = close
+
+        DailyPrice.objects.bulk_create(
+            [
+                DailyPrice(stock_id=stock_id, date=day, close=close)
+                for (stock_id, day), close in closes.items()
+            ],
+            update_conflicts=True,
+            unique_fields=["stock", "date"],
+            update_fields=["close"],
+            batch_size=options["batch_size"],
+        )
+
+        self.stdout.write(
+            f"Loaded {len(closes)} closing prices of {len(set(stock_ids))} stocks."
+        )
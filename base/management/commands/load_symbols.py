@@ -0,0 +1,49 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from base.model_choices import EXCHANGE_CHOICES
+from base.models import TickerExchange
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds the index of which exchange each ticker is traded in from a local "
+        "symbol list, a CSV file with ticker and exchange columns."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Path of the CSV symbol list.")
+
+    def handle(self, *args, **options):
+        exchanges = {choice[0] for choice in EXCHANGE_CHOICES}
+        now = timezone.now()
+
+        try:
+            with open(options["path"], newline="") as file:
+                rows = list(csv.reader(file))
+        except OSError as e:
+            raise CommandError(e)
+
+        symbols = {}
+        for row in rows:
+            if len(row) < 2:
+                continue
+            ticker, exchange = row[0].strip().upper(), row[1].strip().upper()
+            # Skips the header, and exchanges that prices cannot be looked up from.
+            if exchange in exchanges and len(ticker) <= 10:
+                symbols[ticker] = exchange
+
+        TickerExchange.objects.bulk_create(
+            [
+                TickerExchange(ticker=ticker, exchange=exchange, resolved_at=now)
+                for ticker, exchange in symbols.items()
+            ],
+            update_conflicts=True,
+            unique_fields=["ticker"],
+            update_fields=["exchange", "resolved_at"],
+            batch_size=1000,
+        )
+
+        self.stdout.write(f"Loaded {len(symbols)} symbols.")
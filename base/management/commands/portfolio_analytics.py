@@ -0,0 +1,60 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from base.analytics import analyse_users
+from base.models import PortfolioSnapshot, User
+
+
+class Command(BaseCommand):
+    help = (
+        "Calculates the time-weighted and money-weighted returns, maximum drawdown and "
+        "volatility of every user with portfolio snapshots, in batches of users."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", nargs="+", help="Usernames to analyse.")
+        parser.add_argument("--start", type=date.fromisoformat)
+        parser.add_argument("--end", type=date.fromisoformat)
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of users whose snapshots are loaded at once.",
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(
+            id__in=PortfolioSnapshot.objects.values("user_id")
+        ).order_by("id")
+        if options["users"]:
+            users = users.filter(
+                username__in=[name.lower() for name in options["users"]]
+            )
+        usernames = dict(users.values_list("id", "username"))
+        user_ids = list(usernames)
+
+        start = time.monotonic()
+        for i in range(0, len(user_ids), options["batch_size"]):
+            batch = user_ids[i : i + options["batch_size"]]
+            results = analyse_users(batch, options["start"], options["end"])
+
+            for user_id, analytics in results.items():
+                self.stdout.write(
+                    f"{usernames[user_id]}: "
+                    + ", ".join(
+                        (
+                            f"{name}={value:.4%}"
+                            if isinstance(value, float)
+                            else f"{name}={value}"
+                        )
+                        for name, value in analytics.items()
+                    )
+                )
+
+        elapsed = time.monotonic() - start
+        self.stdout.write(
+            f"Analysed {len(user_ids)} users in {elapsed:.2f} seconds "
+            f"({len(user_ids) / elapsed if elapsed else 0:.0f} users per second)."
+        )
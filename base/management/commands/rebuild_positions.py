@@ -0,0 +1,92 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.utils import timezone
+
+from base.models import Transaction, User
+from base.rebuild import rebuild_users, setup_worker
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalculates every holding from its whole transaction history, e.g. after a "
+        "bug fix or schema change, with batches of users rebuilt in parallel processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", nargs="+", help="Usernames to rebuild.")
+        parser.add_argument(
+            "--since",
+            type=date.fromisoformat,
+            help="Only rebuilds the holdings with transactions on or after this day "
+            "(YYYY-MM-DD).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of worker processes. 1 rebuilds in this process, as does "
+            "SQLite, which only lets one process write at a time.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of users rebuilt together, in one database transaction.",
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options["since"]:
+            since = timezone.make_aware(
+                datetime.combine(options["since"], datetime.min.time())
+            )
+
+        users = User.objects.order_by("id")
+        if options["users"]:
+            users = users.filter(
+                username__in=[name.lower() for name in options["users"]]
+            )
+        if since:
+            users = users.filter(
+                pk__in=Transaction.objects.filter(datetime__gte=since).values("user")
+            )
+
+        user_ids = list(users.values_list("id", flat=True))
+        batch_size = options["batch_size"]
+        batches = [
+            user_ids[i : i + batch_size] for i in range(0, len(user_ids), batch_size)
+        ]
+
+        workers = options["workers"]
+        if workers > 1 and connection.vendor == "sqlite":
+            # Workers would only wait on each other's write lock, until they time out.
+            self.stdout.write("SQLite only has one writer, so rebuilding in 1 process.")
+            workers = 1
+
+        start = time.monotonic()
+        if workers > 1 and len(batches) > 1:
+            # Forked workers would otherwise share this process's database connection.
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=workers, initializer=setup_worker
+            ) as executor:
+                results = list(
+                    executor.map(rebuild_users, batches, [since] * len(batches))
+                )
+        else:
+            results = [rebuild_users(batch, since) for batch in batches]
+        elapsed = time.monotonic() - start
+
+        positions = sum(result[0] for result in results)
+        transactions = sum(result[1] for result in results)
+        self.stdout.write(
+            f"Rebuilt {positions} positions of {len(user_ids)} users from "
+            f"{transactions} transactions in {elapsed:.2f} seconds "
+            f"({positions / elapsed if elapsed else 0:.0f} positions/s, "
+            f"{transactions / elapsed if elapsed else 0:.0f} transactions/s)."
+        )
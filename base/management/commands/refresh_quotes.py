@@ -0,0 +1,63 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from base.models import Stock, is_outside_trading_hours
+
+
+class Command(BaseCommand):
+    help = (
+        "Keeps stock prices warm in the background, so that pages read prices "
+        "straight from the database instead of web scraping them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=60,
+            help="Seconds to wait between refreshes while the market is open.",
+        )
+        parser.add_argument(
+            "--closed-interval",
+            type=int,
+            default=900,
+            help="Seconds to wait between refreshes while the market is closed.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Refresh stale prices once and exit.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                self.refresh()
+
+                if options["once"]:
+                    return
+
+                # Prices stay the same while the market is closed, so back off.
+                if is_outside_trading_hours():
+                    time.sleep(options["closed_interval"])
+                else:
+                    time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped refreshing quotes.")
+
+    def refresh(self):
+        # Long running process, so drop connections that have gone stale.
+        close_old_connections()
+
+        # Tickers that users currently hold are refreshed first.
+        held = Stock.objects.filter(ownedstock__current_quantity__gt=0).distinct()
+        updated_held = Stock.refresh_prices(held)
+        updated_others = Stock.refresh_prices(
+            Stock.objects.exclude(pk__in=held.values("pk"))
+        )
+
+        self.stdout.write(
+            f"Refreshed {len(updated_held)} held and {len(updated_others)} other stock prices."
+        )
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from base.journal import regenerate
+from base.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds every user's positions and cash from the journal and overwrites their "
+        "holdings and cash with them, listing what differed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", nargs="+", help="Usernames to replay.")
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only lists the differences, without changing anything.",
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by("id")
+        if options["users"]:
+            users = users.filter(
+                username__in=[name.lower() for name in options["users"]]
+            )
+
+        start = time.monotonic()
+        total = 0
+        mismatched = 0
+        for user in users.iterator():
+            differences = regenerate(user, save=not options["check"])
+            total += 1
+            if differences:
+                mismatched += 1
+                for difference in differences:
+                    self.stdout.write(f"{user.username}: {difference}")
+
+        self.stdout.write(
+            f"Replayed the journals of {total} users in "
+            f"{time.monotonic() - start:.2f} seconds, {mismatched} of which differed."
+        )
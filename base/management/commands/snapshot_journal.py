@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from base.journal import take_snapshot
+from base.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Snapshots every user's positions and cash as of their last journal event, so "
+        "that rebuilding them from the journal only replays the events after it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", nargs="+", help="Usernames to snapshot.")
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by("id")
+        if options["users"]:
+            users = users.filter(
+                username__in=[name.lower() for name in options["users"]]
+            )
+
+        start = time.monotonic()
+        total = 0
+        for user in users.iterator():
+            take_snapshot(user)
+            total += 1
+
+        self.stdout.write(
+            f"Took {total} journal snapshots in {time.monotonic() - start:.2f} seconds."
+        )
@@ -0,0 +1,43 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from base.models import PortfolioSnapshot, User
+
+
+class Command(BaseCommand):
+    help = (
+        "Snapshots every user's cash, holdings and net account value at the close of each "
+        "day since their last snapshot. Meant to be run nightly, e.g. by cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--until",
+            type=date.fromisoformat,
+            help="Last day (YYYY-MM-DD) to snapshot. Defaults to yesterday.",
+        )
+        parser.add_argument(
+            "--since",
+            type=date.fromisoformat,
+            help="Takes the snapshots from this day (YYYY-MM-DD) onwards again, "
+            "e.g. after transactions were backdated.",
+        )
+        parser.add_argument("--users", nargs="+", help="Usernames to snapshot.")
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by("id")
+        if options["users"]:
+            users = users.filter(
+                username__in=[name.lower() for name in options["users"]]
+            )
+
+        start = time.monotonic()
+        total = 0
+        for user in users.iterator():
+            total += PortfolioSnapshot.take(user, options["until"], options["since"])
+
+        self.stdout.write(
+            f"Took {total} snapshots in {time.monotonic() - start:.2f} seconds."
+        )
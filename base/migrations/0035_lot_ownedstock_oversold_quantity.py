@@ -0,0 +1,103 @@
+# Generated by Django 5.0.1 on 2026-10-18 13:50
+
+import base.models
+import django.core.validators
+import django.db.models.deletion
+from collections import deque
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def match_lots(transactions):
+    """
+    Matches (id, direction, quantity) rows, ordered by datetime, first in first out.
+    Returns the remaining quantity of each buy, and the quantity still oversold.
+
+    A copy of the FIFO lot engine as it was when this migration was written, so that
+    later changes to base.positions do not change what this migration does.
+    """
+    remaining_quantities = {}
+    open_lots = deque()
+    oversold_quantity = Decimal()
+
+    for id, direction, quantity in transactions:
+        if direction == "buy":
+            # Buys cover the earliest oversold sells first.
+            covered = min(oversold_quantity, quantity)
+            oversold_quantity -= covered
+            remaining_quantities[id] = quantity - covered
+            if remaining_quantities[id]:
+                open_lots.append(id)
+            continue
+
+        while quantity and open_lots:
+            lot = open_lots[0]
+            taken = min(quantity, remaining_quantities[lot])
+            remaining_quantities[lot] -= taken
+            quantity -= taken
+            if not remaining_quantities[lot]:
+                open_lots.popleft()
+        oversold_quantity += quantity
+
+    return remaining_quantities, oversold_quantity
+
+
+def build_lots(apps, schema_editor):
+    OwnedStock = apps.get_model("base", "OwnedStock")
+    Transaction = apps.get_model("base", "Transaction")
+    Lot = apps.get_model("base", "Lot")
+
+    for owned_stock in OwnedStock.objects.all():
+        transactions = list(
+            Transaction.objects.filter(owned_stock=owned_stock)
+            .order_by("datetime", "id")
+            .values_list("id", "direction", "quantity", "datetime", "unit_price")
+        )
+        remaining_quantities, oversold_quantity = match_lots(
+            transaction[:3] for transaction in transactions
+        )
+
+        Lot.objects.bulk_create(
+            Lot(
+                transaction_id=id,
+                owned_stock=owned_stock,
+                datetime=datetime,
+                unit_price=unit_price,
+                quantity=quantity,
+                remaining_quantity=remaining_quantities[id],
+            )
+            for id, direction, quantity, datetime, unit_price in transactions
+            if direction == "buy"
+        )
+        owned_stock.oversold_quantity = oversold_quantity
+        owned_stock.save(update_fields=["oversold_quantity"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0034_stock_exchange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ownedstock',
+            name='oversold_quantity',
+            field=base.models.PositiveDecimalField(decimal_places=2, default=Decimal('0.0'), max_digits=10, validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.CreateModel(
+            name='Lot',
+            fields=[
+                ('transaction', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='base.transaction')),
+                ('datetime', models.DateTimeField()),
+                ('unit_price', base.models.PositiveDecimalField(decimal_places=2, max_digits=10, validators=[django.core.validators.MinValueValidator(0)])),
+                ('quantity', base.models.PositiveDecimalField(decimal_places=2, max_digits=10, validators=[django.core.validators.MinValueValidator(0)])),
+                ('remaining_quantity', base.models.PositiveDecimalField(decimal_places=2, max_digits=10, validators=[django.core.validators.MinValueValidator(0)])),
+                ('owned_stock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.ownedstock')),
+            ],
+            options={
+                'ordering': ['datetime', 'transaction_id'],
+            },
+        ),
+        migrations.RunPython(build_lots, migrations.RunPython.noop),
+    ]
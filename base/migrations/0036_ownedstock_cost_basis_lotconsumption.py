@@ -0,0 +1,96 @@
+# Generated by Django 5.0.1 on 2026-10-18 13:56
+
+import base.models
+import django.core.validators
+import django.db.models.deletion
+from collections import deque
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def consume_lots(transactions):
+    """
+    Matches (id, direction, quantity, unit price) rows, ordered by datetime, first in
+    first out. Returns a (sell id, lot id, quantity) tuple for each part of a lot that
+    a sell consumed, and the cost of the lots that are still open.
+
+    Frozen here instead of importing FifoBook from base.positions, which may change
+    after this migration.
+    """
+    consumptions = []
+    open_lots = deque()  # [id, remaining quantity, unit price]
+    oversold = deque()  # [sell id, uncovered quantity]
+
+    for id, direction, quantity, unit_price in transactions:
+        if direction == "buy":
+            # Buys cover the earliest oversold sells first.
+            while quantity and oversold:
+                sell = oversold[0]
+                covered = min(sell[1], quantity)
+                sell[1] -= covered
+                quantity -= covered
+                consumptions.append((sell[0], id, covered))
+                if not sell[1]:
+                    oversold.popleft()
+            if quantity:
+                open_lots.append([id, quantity, unit_price])
+            continue
+
+        while quantity and open_lots:
+            lot = open_lots[0]
+            taken = min(quantity, lot[1])
+            lot[1] -= taken
+            quantity -= taken
+            consumptions.append((id, lot[0], taken))
+            if not lot[1]:
+                open_lots.popleft()
+        if quantity:
+            oversold.append([id, quantity])
+
+    cost = sum((lot[1] * lot[2] for lot in open_lots), Decimal())
+    return consumptions, cost
+
+
+def record_consumptions(apps, schema_editor):
+    OwnedStock = apps.get_model("base", "OwnedStock")
+    Transaction = apps.get_model("base", "Transaction")
+    LotConsumption = apps.get_model("base", "LotConsumption")
+
+    for owned_stock in OwnedStock.objects.all():
+        consumptions, cost = consume_lots(
+            Transaction.objects.filter(owned_stock=owned_stock)
+            .order_by("datetime", "id")
+            .values_list("id", "direction", "quantity", "unit_price")
+        )
+
+        LotConsumption.objects.bulk_create(
+            LotConsumption(transaction_id=sell_id, lot_id=lot_id, quantity=quantity)
+            for sell_id, lot_id, quantity in consumptions
+        )
+        owned_stock.cost_basis = cost
+        owned_stock.save(update_fields=["cost_basis"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0035_lot_ownedstock_oversold_quantity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ownedstock',
+            name='cost_basis',
+            field=base.models.PositiveDecimalField(decimal_places=4, default=Decimal('0.0'), max_digits=14, validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.CreateModel(
+            name='LotConsumption',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', base.models.PositiveDecimalField(decimal_places=2, max_digits=10, validators=[django.core.validators.MinValueValidator(0)])),
+                ('lot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.lot')),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.transaction')),
+            ],
+        ),
+        migrations.RunPython(record_consumptions, migrations.RunPython.noop),
+    ]
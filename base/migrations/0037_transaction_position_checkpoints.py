@@ -0,0 +1,113 @@
+# Generated by Django 5.0.1 on 2026-10-18 13:57
+
+from collections import deque
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def positions(transactions):
+    """
+    Matches (id, direction, quantity, unit price) rows, ordered by datetime, first in
+    first out. Yields the position after each transaction, as an (id, quantity, cost,
+    realised P&L, oversold quantity) tuple.
+
+    Replays positions the way FifoBook did when this migration was written, as
+    migrations must not import code that may change after them.
+    """
+    open_lots = deque()  # [remaining quantity, unit price]
+    oversold = deque()  # uncovered quantities of oversold sells
+    quantity = cost = realised_pnl = Decimal()
+
+    for id, direction, unconsidered_quantity, unit_price in transactions:
+        if direction == "buy":
+            # Buys cover the earliest oversold sells first.
+            while unconsidered_quantity and oversold:
+                covered = min(oversold[0], unconsidered_quantity)
+                oversold[0] -= covered
+                unconsidered_quantity -= covered
+                realised_pnl -= covered * unit_price
+                if not oversold[0]:
+                    oversold.popleft()
+            if unconsidered_quantity:
+                open_lots.append([unconsidered_quantity, unit_price])
+                quantity += unconsidered_quantity
+                cost += unconsidered_quantity * unit_price
+        else:
+            realised_pnl += unconsidered_quantity * unit_price
+            while unconsidered_quantity and open_lots:
+                lot = open_lots[0]
+                taken = min(unconsidered_quantity, lot[0])
+                lot[0] -= taken
+                unconsidered_quantity -= taken
+                quantity -= taken
+                cost -= taken * lot[1]
+                realised_pnl -= taken * lot[1]
+                if not lot[0]:
+                    open_lots.popleft()
+            if unconsidered_quantity:
+                oversold.append(unconsidered_quantity)
+
+        yield id, quantity, cost, realised_pnl, sum(oversold, Decimal())
+
+
+def checkpoint_positions(apps, schema_editor):
+    OwnedStock = apps.get_model("base", "OwnedStock")
+    Transaction = apps.get_model("base", "Transaction")
+
+    for owned_stock in OwnedStock.objects.all():
+        checkpoints = [
+            Transaction(
+                id=id,
+                position_quantity=quantity,
+                position_cost=cost,
+                position_realised_pnl=realised_pnl,
+                position_oversold_quantity=oversold_quantity,
+            )
+            for id, quantity, cost, realised_pnl, oversold_quantity in positions(
+                Transaction.objects.filter(owned_stock=owned_stock)
+                .order_by("datetime", "id")
+                .values_list("id", "direction", "quantity", "unit_price")
+            )
+        ]
+
+        Transaction.objects.bulk_update(
+            checkpoints,
+            [
+                "position_quantity",
+                "position_cost",
+                "position_realised_pnl",
+                "position_oversold_quantity",
+            ],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0036_ownedstock_cost_basis_lotconsumption'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='position_cost',
+            field=models.DecimalField(decimal_places=4, editable=False, max_digits=14, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='position_oversold_quantity',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='position_quantity',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='position_realised_pnl',
+            field=models.DecimalField(decimal_places=4, editable=False, max_digits=14, null=True),
+        ),
+        migrations.RunPython(checkpoint_positions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.1 on 2026-10-18 14:03
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def remember_stock_exchanges(apps, schema_editor):
+    Stock = apps.get_model("base", "Stock")
+    TickerExchange = apps.get_model("base", "TickerExchange")
+
+    TickerExchange.objects.bulk_create(
+        TickerExchange(ticker=ticker, exchange=exchange)
+        for ticker, exchange in Stock.objects.exclude(exchange=None).values_list(
+            "ticker", "exchange"
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0037_transaction_position_checkpoints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TickerExchange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticker', models.CharField(max_length=10, unique=True)),
+                ('exchange', models.CharField(choices=[('NASDAQ', 'NASDAQ'), ('NYSE', 'NYSE'), ('NYSEARCA', 'NYSEARCA')], max_length=10, null=True)),
+                ('resolved_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(remember_stock_exchanges, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.1 on 2026-10-18 14:08
+
+import base.models
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def record_last_prices(apps, schema_editor):
+    Stock = apps.get_model("base", "Stock")
+    DailyPrice = apps.get_model("base", "DailyPrice")
+
+    DailyPrice.objects.bulk_create(
+        DailyPrice(stock_id=id, date=timezone.localdate(last_updated), close=price)
+        for id, price, last_updated in Stock.objects.values_list(
+            "id", "_price", "last_updated"
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0038_tickerexchange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyPrice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('close', base.models.PositiveDecimalField(decimal_places=2, max_digits=10, validators=[django.core.validators.MinValueValidator(0)])),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.stock')),
+            ],
+            options={
+                'ordering': ['stock', 'date'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailyprice',
+            constraint=models.UniqueConstraint(fields=('stock', 'date'), name='unique_daily_price'),
+        ),
+        migrations.RunPython(record_last_prices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.1 on 2026-10-18 14:09
+
+import base.models
+import django.core.validators
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0039_dailyprice'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PortfolioSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('cash', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('value', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('nav', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['user', 'date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='HoldingSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', base.models.PositiveDecimalField(decimal_places=2, max_digits=10, validators=[django.core.validators.MinValueValidator(0)])),
+                ('close', base.models.PositiveDecimalField(decimal_places=2, max_digits=10, validators=[django.core.validators.MinValueValidator(0)])),
+                ('value', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.stock')),
+                ('snapshot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.portfoliosnapshot')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='portfoliosnapshot',
+            constraint=models.UniqueConstraint(fields=('user', 'date'), name='unique_portfolio_snapshot'),
+        ),
+    ]
@@ -0,0 +1,104 @@
+# Generated by Django 5.0.1 on 2026-10-18 14:20
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def record_history(apps, schema_editor):
+    """Records the existing transactions and transfers of each user as journal events."""
+    User = apps.get_model("base", "User")
+    Transaction = apps.get_model("base", "Transaction")
+    Transfer = apps.get_model("base", "Transfer")
+    JournalEvent = apps.get_model("base", "JournalEvent")
+
+    for user in User.objects.all():
+        trades = [
+            (
+                transaction.datetime,
+                JournalEvent(
+                    user=user,
+                    kind="trade",
+                    stock_id=transaction.owned_stock.stock_id,
+                    payload={
+                        "id": transaction.id,
+                        "datetime": transaction.datetime.isoformat(),
+                        "direction": transaction.direction,
+                        "quantity": transaction.quantity,
+                        "unit_price": transaction.unit_price,
+                    },
+                ),
+            )
+            for transaction in Transaction.objects.filter(user=user)
+            .select_related("owned_stock")
+            .order_by("datetime", "id")
+        ]
+        transfers = [
+            (
+                transfer.datetime,
+                JournalEvent(
+                    user=user,
+                    kind="transfer",
+                    payload={
+                        "method": transfer.method,
+                        "value": transfer.value,
+                        "old_cash": transfer.old_cash,
+                        "new_cash": transfer.new_cash,
+                    },
+                ),
+            )
+            for transfer in Transfer.objects.filter(user=user).order_by("datetime", "id")
+        ]
+        events = [
+            event
+            for datetime, event in sorted(trades + transfers, key=lambda pair: pair[0])
+        ]
+
+        # Cash that was changed other than by a transfer is corrected to its current value.
+        last_cash = transfers[-1][1].payload["new_cash"] if transfers else 0
+        if user.cash != last_cash:
+            events.append(
+                JournalEvent(user=user, kind="correction", payload={"cash": user.cash})
+            )
+
+        JournalEvent.objects.bulk_create(events, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0040_portfolio_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JournalEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('trade', 'Trade'), ('trade_deleted', 'Trade deleted'), ('transfer', 'Transfer'), ('correction', 'Correction')], max_length=20)),
+                ('payload', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('recorded_at', models.DateTimeField(auto_now_add=True)),
+                ('stock', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='base.stock')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='JournalSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_event_id', models.BigIntegerField()),
+                ('state', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['user', 'last_event_id'],
+                'indexes': [models.Index(fields=['user', 'last_event_id'], name='base_journa_user_id_0fddb4_idx')],
+            },
+        ),
+        migrations.RunPython(record_history, migrations.RunPython.noop),
+    ]
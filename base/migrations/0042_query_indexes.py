@@ -0,0 +1,37 @@
+# Generated by Django 5.0.1 on 2026-10-18 14:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0041_journal'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lot',
+            index=models.Index(condition=models.Q(('remaining_quantity__gt', 0)), fields=['owned_stock', 'datetime', 'transaction', 'remaining_quantity', 'unit_price'], name='lot_open_scan_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ownedstock',
+            index=models.Index(fields=['user', 'stock'], name='holding_user_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ownedstock',
+            index=models.Index(condition=models.Q(('current_quantity__gt', 0)), fields=['user'], name='holding_open_position_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['owned_stock', 'datetime', 'id'], name='transaction_holding_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', 'datetime', 'id'], name='transaction_user_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['user', 'datetime', 'id'], name='transfer_user_order_idx'),
+        ),
+    ]
@@ -1,20 +1,25 @@
-import re
+from collections import deque
 from datetime import datetime, time, timedelta
 from decimal import Decimal
 from types import NoneType
 
 import requests
-from bs4 import BeautifulSoup
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.db.models import Q
+from django.db import connection, models
+from django.db import transaction as db_transaction
+from django.db.models import F, OuterRef, Q, Subquery
 from django.db.models.query import QuerySet
+from django.db.transaction import TransactionManagementError
 from django.utils import timezone
 
 from .model_choices import EXCHANGE_CHOICES, HC_CHOICES, TZ_CHOICES
+from .positions import FifoBook
+from .providers import get_fx_provider, get_quote_provider
+from .singleflight import acquire_lease, release_lease, single_flight
 
 
 # Helper functions
@@ -64,44 +69,72 @@ class CurrencyConversionRate(models.Model):
     @property
     def ccrate(self) -> Decimal:
         # If currency conversion rate (_ccrate) was updated within the past 30 mins and if the rate isn't 0, return the rate.
-        if (
-            timezone.now() - self.last_updated < timezone.timedelta(minutes=30)
-            and self._ccrate
-        ):
+        if not self.is_rate_stale():
             return self._ccrate
 
-        # URL of the webpage
-        url = f"https://www.xe.com/currencyconverter/convert/?Amount=1&From={self.cfrom}&To={self.cto}"
+        # Only one caller web scrapes the rate at a time, the rest reuse its result.
+        def reload():
+            self.refresh_from_db(fields=["_ccrate", "last_updated"])
+            return not self.is_rate_stale()
 
-        # Send a GET request to the URL
-        response = requests.get(url)
+        single_flight(f"ccrate:{self.cfrom}:{self.cto}", self.update_rate, reload)
 
-        # Parse the HTML content of the webpage
-        soup = BeautifulSoup(response.text, "html.parser")
+        return self._ccrate
 
-        rate = soup.find("p", {"class": "sc-1c293993-1 fxoXHw"})
+    def is_rate_stale(self):
+        return not (
+            timezone.now() - self.last_updated < timezone.timedelta(minutes=30)
+            and self._ccrate
+        )
 
-        if rate:
-            match = re.match(r"^\d+\.\d+", rate.text)  # type: ignore
+    def update_rate(self):
+        try:
+            rate = get_fx_provider().get_rate(self.cfrom, self.cto)
+        except requests.RequestException as e:
+            # Keep serving the stored rate, which stays stale, so that it is retried.
+            print(f"Failed to fetch rate {self.cfrom}{self.cto}: {e}")
+            return
 
-        if match:
-            self._ccrate = Decimal(match.group())
+        if rate:
+            self._ccrate = rate
+            self.save()
+        elif not self._ccrate:
+            self._ccrate = Decimal()
             self.save()
-            print(
-                f"Web Scraped rate {self.cfrom}{self.cto} successfully at {self._ccrate}."
-            )
-        else:
-            print(f"Web Scraped rate {self.cfrom}{self.cto} unsuccessfully.")
-            if not self._ccrate:
-                self._ccrate = Decimal()
-                self.save()
 
-        return self._ccrate
-    
     def __str__(self):
         return f"{self.cfrom}/{self.cto} has an exchange rate of {self.ccrate}."
 
 
+class TickerExchange(models.Model):
+    """
+    Remembers which exchange a ticker is traded in, or that it is not traded in any
+    exchange (exchange is None), so that looking up a ticker does not probe every exchange.
+    """
+
+    ticker = models.CharField(max_length=10, unique=True)
+    exchange = models.CharField(max_length=10, choices=EXCHANGE_CHOICES, null=True)
+    resolved_at = models.DateTimeField(default=timezone.now)
+
+    def is_expired(self):
+        if self.exchange:
+            ttl = settings.EXCHANGE_RESOLUTION_TTL
+        else:
+            ttl = settings.EXCHANGE_RESOLUTION_NEGATIVE_TTL
+
+        return timezone.now() - self.resolved_at >= timedelta(seconds=ttl)
+
+    @classmethod
+    def remember(cls, ticker, exchange):
+        cls.objects.update_or_create(
+            ticker=ticker,
+            defaults={"exchange": exchange, "resolved_at": timezone.now()},
+        )
+
+    def __str__(self):
+        return f"{self.ticker} is traded in {self.exchange or 'no exchange'}."
+
+
 class Stock(models.Model):
     ticker = models.CharField(max_length=10, unique=True)
     exchange = models.CharField(max_length=10, choices=EXCHANGE_CHOICES, null=True)
@@ -116,96 +149,230 @@ class Stock(models.Model):
 
     @property
     def price(self):
-        self.update_stock_info()
+        # When the refresh_quotes command keeps prices warm, read straight from the database.
+        if not settings.BACKGROUND_QUOTE_REFRESH:
+            self.update_stock_info()
         return self._price
 
     @classmethod
     def get_stock_price(
         cls, ticker: str, exchange: str | NoneType = None
     ) -> tuple[Decimal, str | None] | None:
+        """
+        Returns the price of the ticker and the exchange it is traded in, or None if it
+        is not traded in the exchange (any exchange, if exchange is None).
+        Raises requests.RequestException if it could not be looked up, in which case
+        whether the ticker is traded is left unknown.
+        """
         ticker = ticker.upper()
+        provider = get_quote_provider()
 
-        def web_scrape(ticker, exchange) -> Decimal | NoneType:
-            # URL of GOOGLE FINANCE Page
-            url = f"https://www.google.com/finance/quote/{ticker}:{exchange}"
-
-            # Send a GET request to the URL
-            response = requests.get(url)
-
-            # Parse the HTML content of the webpage
-            soup = BeautifulSoup(response.text, "html.parser")
-
-            latest = soup.find("div", class_="YMlKec fxKbKc")
-
-            if latest:
-                match = re.search(r"\d+\.\d{2}", latest.text)  # type: ignore
-            else:
-                print(f"No match for {ticker}:{exchange} in web scraping.")
-                return
-
-            if match:
-                print(
-                    f"Web Scraped {ticker}:{exchange} successfully at the latest price of {latest.text}."
-                )
-                return Decimal(match.group())
-
-            else:
-                print(f"Web Scraped {ticker}:{exchange} unsuccessfully.")
-                return Decimal()
+        # If the exchange where ticker is traded in is known,
+        if exchange:
+            price = provider.get_price(ticker, exchange)
+            return (price, exchange) if price else None
 
-        # If the exchange where ticker is traded in is unknown,
-        if not exchange:
-            for choice in EXCHANGE_CHOICES:
-                exchange = choice[0]
-                price = web_scrape(ticker, exchange)
+        # If the exchange where ticker is traded in is unknown, check if it was resolved before.
+        exchanges = [choice[0] for choice in EXCHANGE_CHOICES]
+        resolved = TickerExchange.objects.filter(ticker=ticker).first()
 
-                if price:
-                    return price, exchange
+        if resolved and not resolved.is_expired():
+            # The ticker is known to be invalid.
+            if not resolved.exchange:
+                return None
 
-        # If the exchange where ticker is traded in is known,
-        else:
-            price = web_scrape(ticker, exchange)
+            price = provider.get_price(ticker, resolved.exchange)
             if price:
+                return price, resolved.exchange
+
+            # The ticker moved to another exchange.
+            exchanges.remove(resolved.exchange)
+
+        # Probe the remaining exchanges concurrently.
+        prices = provider.get_prices([(ticker, exchange) for exchange in exchanges])
+        errors = []
+        for exchange, price in zip(exchanges, prices):
+            if isinstance(price, requests.RequestException):
+                errors.append(price)
+            elif price:
+                TickerExchange.remember(ticker, exchange)
                 return price, exchange
 
+        # The ticker may be traded in an exchange that could not be probed.
+        if errors:
+            raise errors[0]
+
+        TickerExchange.remember(ticker, None)
         return None
 
     @classmethod
-    def create_stock_if_valid(cls, ticker):
+    def look_up(cls, ticker) -> "Stock | None":
+        """
+        Returns a new, unsaved stock of the ticker if it is traded in any exchange, or None.
+        Raises requests.RequestException if the ticker could not be looked up.
+        """
         ticker = ticker.upper()
 
         price = cls.get_stock_price(ticker)  # type: ignore
 
         if price:
-            return cls.objects.create(ticker=ticker, _price=price[0], exchange=price[1])
+            return cls(ticker=ticker, _price=price[0], exchange=price[1])
 
         return None
 
-    def update_stock_info(self):
-        # if time now is in a time when market is closed, AND last_update is after the time market was closed, just return.
+    @classmethod
+    def refresh_prices(cls, stocks=None, max_workers=None):
+        """
+        Updates the price of every stale stock in stocks (all stocks if none are given).
+        The stale tickers are looked up concurrently (or in a single batch, if the quote
+        provider can), and the results are written back with a single bulk_update.
+
+        Returns the list of stocks that were updated.
+        """
+        if stocks is None:
+            stocks = cls.objects.all()
 
+        # Deduplicate by primary key, so that a ticker is only fetched once per refresh
+        stale_stocks = list(
+            {stock.pk: stock for stock in stocks if stock.is_price_stale()}.values()
+        )
+
+        # Leave the tickers that another caller is already fetching to that caller.
+        stale_stocks = [
+            stock for stock in stale_stocks if acquire_lease(f"stock:{stock.ticker}")
+        ]
+        if not stale_stocks:
+            return []
+
+        try:
+            return cls.fetch_prices(stale_stocks, max_workers)
+        finally:
+            for stock in stale_stocks:
+                release_lease(f"stock:{stock.ticker}")
+
+    @classmethod
+    def fetch_prices(cls, stale_stocks, max_workers=None):
+        """
+        Looks up the prices of stale_stocks from the quote provider, concurrently or
+        in a single batch, and saves them with a single bulk_update.
+        """
+        prices = get_quote_provider().get_prices(
+            [(stock.ticker, stock.exchange) for stock in stale_stocks], max_workers
+        )
+
+        # bulk_update does not trigger auto_now, so last_updated is set explicitly.
+        now = timezone.now()
+        updated_stocks = []
+        for stock, price in zip(stale_stocks, prices):
+            if isinstance(price, requests.RequestException):
+                # Keep the stored price until the next refresh.
+                continue
+
+            if not price and not stock.exchange:
+                # Stocks without a known exchange have to be looked up on every exchange.
+                try:
+                    found = cls.get_stock_price(stock.ticker)
+                except requests.RequestException as e:
+                    print(f"Failed to look up {stock.ticker}'s exchange: {e}")
+                    continue
+                price, stock.exchange = found or (None, None)
+
+            if price:
+                stock._price = price
+                stock.last_updated = now
+                updated_stocks.append(stock)
+            else:
+                # Exchange is wrong
+                print(f"Check exchange if it is correct for {stock.ticker}")
+
+        cls.objects.bulk_update(updated_stocks, ["_price", "exchange", "last_updated"])
+        DailyPrice.objects.record(updated_stocks)
+        print(f"Updated {len(updated_stocks)} of {len(stale_stocks)} stale prices")
+
+        return updated_stocks
+
+    def is_price_stale(self):
+        # if time now is in a time when market is closed, AND last_update is after the time market was closed, the price is not stale.
         if (
             is_outside_trading_hours()
             and is_after_market_close(self.last_updated)
             or timezone.now() - self.last_updated < timezone.timedelta(minutes=5)
         ):
+            return False
+
+        return True
+
+    def update_stock_info(self):
+        if not self.is_price_stale():
             return
 
-        price = self.get_stock_price(ticker=self.ticker, exchange=self.exchange)
+        def fetch():
+            try:
+                price = self.get_stock_price(ticker=self.ticker, exchange=self.exchange)
+            except requests.RequestException as e:
+                # Keep serving the stored price, which stays stale, so that it is retried.
+                print(f"Failed to fetch {self.ticker}'s price: {e}")
+                return
 
-        if price:
-            self._price = price[0]
-            self.exchange = price[1]
-            self.save()
-            print(f"Updated {self.ticker}'s price")
-        else:
-            # Exchange is wrong
-            print(f"Check exchange if it is correct for {self.ticker}")
+            if price:
+                self._price = price[0]
+                self.exchange = price[1]
+                self.save()
+                DailyPrice.objects.record([self])
+                print(f"Updated {self.ticker}'s price")
+            else:
+                # Exchange is wrong
+                print(f"Check exchange if it is correct for {self.ticker}")
+
+        # Only one caller web scrapes the price at a time, the rest reuse its result.
+        def reload():
+            self.refresh_from_db(fields=["_price", "exchange", "last_updated"])
+            return not self.is_price_stale()
+
+        single_flight(f"stock:{self.ticker}", fetch, reload)
 
     def __str__(self):
         return f"{self.ticker} has a price of {self._price}."
 
 
+class DailyPriceQuerySet(models.QuerySet):
+    def record(self, stocks, date=None):
+        """
+        Saves the current price of each stock as its close on date (today in the market's
+        timezone by default) in a single query, overwriting any close already saved for
+        that date, so that the last price seen on a day becomes its close.
+        """
+        date = date or timezone.localdate()
+
+        return self.bulk_create(
+            [
+                DailyPrice(stock=stock, date=date, close=stock._price)
+                for stock in stocks
+            ],
+            update_conflicts=True,
+            unique_fields=["stock", "date"],
+            update_fields=["close"],
+        )
+
+
+class DailyPrice(models.Model):
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE)
+    date = models.DateField()
+    close = PositiveDecimalField(max_digits=10, decimal_places=2)
+
+    objects = DailyPriceQuerySet.as_manager()
+
+    class Meta:
+        # The unique constraint's index on (stock, date) serves the latest close lookups.
+        constraints = [
+            models.UniqueConstraint(fields=["stock", "date"], name="unique_daily_price")
+        ]
+        ordering = ["stock", "date"]
+
+    def __str__(self):
+        return f"{self.stock.ticker} closed at {self.close} on {self.date}."
+
+
 class User(AbstractUser):
     username = models.CharField(max_length=100, unique=True)
     email = models.EmailField(unique=True)
@@ -221,24 +388,82 @@ class User(AbstractUser):
     class Meta:
         ordering = ["username"]
 
+    def transfer_cash(self, method: str, value: Decimal):
+        """
+        Deposits, withdraws or sets the user's cash, and records it as a Transfer.
+        Returns None without changing anything if the user withdraws more cash than they own.
+
+        The balance is changed in the database with an F() expression, which also locks
+        the user's row, so concurrent transfers are applied one after another instead
+        of overwriting each other. The old and new balances are read back within the
+        same database transaction, and only the cash column is written.
+        """
+        users = User.objects.filter(pk=self.pk)
+
+        with db_transaction.atomic():
+            if method == "deposit":
+                users.update(cash=F("cash") + value)
+                new_cash = users.values_list("cash", flat=True).get()
+                old_cash = new_cash - value
+            elif method == "withdrawal":
+                if not users.filter(cash__gte=value).update(cash=F("cash") - value):
+                    return None
+                new_cash = users.values_list("cash", flat=True).get()
+                old_cash = new_cash + value
+            elif method == "set":
+                # Take the row lock before reading the old balance.
+                users.update(cash=F("cash"))
+                old_cash = users.values_list("cash", flat=True).get()
+                users.update(cash=value)
+                new_cash = value
+            else:
+                raise ValueError(f"{method} is not a transfer method.")
+
+            transfer = Transfer.objects.create(
+                user=self,
+                method=method,
+                value=value,
+                old_cash=old_cash,
+                new_cash=new_cash,
+                datetime=timezone.now(),
+            )
+            JournalEvent.transfer(transfer).save()
+
+        self.cash = new_cash
+        return transfer
+
     def get_holdings(self):
-        owned_stocks: QuerySet[OwnedStock] = self.ownedstock_set.filter(  # type: ignore
-            current_quantity__gt=0
-        ).order_by("stock__ticker")
+        owned_stocks: QuerySet[OwnedStock] = (
+            self.ownedstock_set.filter(current_quantity__gt=0)  # type: ignore
+            .select_related("stock")
+            .order_by("stock__ticker")
+        )
 
         return owned_stocks
 
-    def get_nav(self, holdings):
-        return (
-            sum(
-                [
-                    ownedStock.stock.price * ownedStock.current_quantity  # type: ignore
-                    for ownedStock in holdings
-                ]
-            )  # type: ignore
-            + self.cash
+    def get_dashboard(self):
+        """
+        Loads the holdings of the user, with their stocks and transactions, in a fixed
+        number of queries, and calculates the net account value, total unrealised
+        and total realised profits and losses in the database.
+        """
+        holdings = list(
+            self.get_holdings().with_price_changes().prefetch_related("transaction_set")
         )
 
+        # Refresh all stale prices on the page at once, instead of one by one on access.
+        if not settings.BACKGROUND_QUOTE_REFRESH:
+            Stock.refresh_prices([ownedStock.stock for ownedStock in holdings])
+
+        summary = OwnedStock.objects.portfolio_summary(self)
+
+        return {
+            "holdings": holdings,
+            "nav": summary["nav"],
+            "tup": summary["total_unrealised_pnl"],
+            "trp": summary["total_realised_pnl"],
+        }
+
     def clean(self):
         super().clean()
         if self.username:
@@ -250,6 +475,92 @@ class User(AbstractUser):
         return f"{self.email} has {self.cash} and owns {self.get_holdings()}"
 
 
+class OwnedStockQuerySet(models.QuerySet):
+    def lock(self) -> list:
+        """
+        Locks the holdings in the queryset until the end of the enclosing atomic block,
+        so that concurrent bookings for the same holding run one after another, and
+        returns them as they are once locked.
+
+        SQLite has no SELECT ... FOR UPDATE, so an update that changes nothing takes the
+        database's write lock instead, even if nothing matches. Being the first write, it
+        waits for other writers to finish for up to the connection's timeout (see
+        DATABASES in settings.py), and fails with "database is locked" after that. Like
+        select_for_update(), it has to be called in an atomic block.
+        """
+        if connection.features.has_select_for_update:
+            return list(self.select_for_update())
+
+        if not connection.in_atomic_block:
+            raise TransactionManagementError(
+                "lock() cannot be used outside of a transaction."
+            )
+
+        self.update(current_quantity=F("current_quantity"))
+        return list(self)
+
+    def lock_or_create(self, user, stock):
+        """Returns the user's locked holding of stock, creating it if there is none."""
+        locked = self.filter(user=user, stock=stock).lock()
+        if locked:
+            return locked[0]
+
+        # There is no row to lock yet, so lock the user instead while creating it,
+        # so that two bookings cannot both create the holding.
+        if connection.features.has_select_for_update:
+            list(User.objects.select_for_update().filter(pk=user.pk))
+
+        owned_stock, _ = self.get_or_create(user=user, stock=stock)
+        return self.filter(pk=owned_stock.pk).lock()[0]
+
+    def with_price_changes(self, date=None):
+        """
+        Annotates each holding with previous_close, its stock's last close before date
+        (today by default), and week_close, its stock's last close at least a week before
+        date, as subqueries of the same query. Either is None if there is no such close.
+        """
+        date = date or timezone.localdate()
+
+        def last_close(**filters):
+            return Subquery(
+                DailyPrice.objects.filter(stock=OuterRef("stock"), **filters)
+                .order_by("-date")
+                .values("close")[:1]
+            )
+
+        return self.annotate(
+            previous_close=last_close(date__lt=date),
+            week_close=last_close(date__lte=date - timedelta(days=7)),
+        )
+
+    def portfolio_summary(self, user):
+        """
+        Calculates the total value, net account value, total unrealised and total realised
+        profits and losses of the user's holdings in a single query, using the stock prices
+        stored in the database.
+        """
+        holding = Q(current_quantity__gt=0)
+        summary = self.filter(user=user).aggregate(
+            total_value=models.Sum(
+                F("stock___price") * F("current_quantity"),
+                filter=holding,
+                default=Decimal(),
+            ),
+            total_unrealised_pnl=models.Sum(
+                (F("stock___price") - F("average_cost_price")) * F("current_quantity"),
+                filter=holding,
+                default=Decimal(),
+            ),
+            total_realised_pnl=models.Sum(
+                "realised_pnl", filter=holding, default=Decimal()
+            ),
+        )
+        summary["cash"] = user.cash
+        summary["nav"] = summary["total_value"] + user.cash
+
+        return summary
+
+
 class OwnedStock(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     current_quantity = PositiveDecimalField(max_digits=10, decimal_places=2, null=True)
@@ -260,91 +571,258 @@ class OwnedStock(models.Model):
     realised_pnl = models.DecimalField(
         max_digits=10, decimal_places=2, default=Decimal("0.0")
     )
+    # Quantity that was sold before it was bought, which later buys will cover first.
+    oversold_quantity = PositiveDecimalField(
+        max_digits=10, decimal_places=2, default=Decimal("0.0")
+    )
+    # Total cost of the open lots, so that the average cost price does not need the transaction history.
+    cost_basis = PositiveDecimalField(
+        max_digits=14, decimal_places=4, default=Decimal("0.0")
+    )
+
+    objects = OwnedStockQuerySet.as_manager()
+
+    # Fields that set_position() sets from a FifoBook.
+    POSITION_FIELDS = [
+        "current_quantity",
+        "cost_basis",
+        "average_cost_price",
+        "oversold_quantity",
+        "realised_pnl",
+    ]
 
     class Meta:
         ordering = ["stock"]
+        indexes = [
+            # Looking up a user's holding of a stock, e.g. when booking a transaction.
+            models.Index(fields=["user", "stock"], name="holding_user_stock_idx"),
+            # Listing a user's open positions, which are fewer than all their holdings.
+            # They are ordered by ticker, which is not in this table, so the stock is not
+            # part of the key.
+            models.Index(
+                fields=["user"],
+                condition=Q(current_quantity__gt=0),
+                name="holding_open_position_idx",
+            ),
+        ]
 
     def update_instance(self):
         """
-        Calculates and updates the current quantity, average cost price and realised profits and losses.
-        based on the transaction history.
+        Calculates and updates the current quantity, average cost price and realised profits and losses
+        based on the transaction history, and rebuilds the lots of the holding.
         Adopts a first in first out approach. i.e.
         The earlier the stock is bought, the greater the priority it will be sold first.
 
-        Firstly, we calculate the currently owned quantity, which is given by
-        currently owned quantity = total buy quantity - total sell quantity
-
-        Secondly, we calculate the cost of the currently owned stocks. This is given by
-        total cost = initial cost of all bought stocks - initial cost of stocks that were already sold.
-        initial cost of all bought stocks = sum of the unit price of each transaction, and the quantity of each transaction for all stocks in the buy direction.
-        initial cost of stocks that were already sold = sum of the unit price of each transaction and the quantity of each transaction for the left over stocks that user owns.
-        """
-        total_buy_quantity: Decimal = (
-            self.transaction_set.filter(direction="buy").aggregate(  # type: ignore
-                models.Sum("quantity")
-            )["quantity__sum"]
-            or 0
-        )  # type: ignore
-        total_sell_quantity: Decimal = (
-            self.transaction_set.filter(direction="sell").aggregate(  # type: ignore
-                models.Sum("quantity")
-            )["quantity__sum"]
-            or 0
-        )  # type: ignore
-
-        total_quantity = total_buy_quantity - total_sell_quantity
-
-        initial_cost_of_all_bought_stocks = sum(
-            transaction.unit_price * transaction.quantity
-            for transaction in self.transaction_set.filter(direction="buy")  # type: ignore
+        The transaction history is fetched in a single query, ordered by datetime,
+        and replayed iteratively through a FifoBook, where each sell consumes the
+        earliest open buy lots.
+        """
+        transactions = list(
+            self.transaction_set.order_by("datetime", "id").values_list(  # type: ignore
+                "id", "direction", "quantity", "unit_price", "datetime"
+            )
         )
 
-        list_of_buy_transactions: QuerySet[Transaction] = self.transaction_set.filter(  # type: ignore
-            direction="buy"
-        ).all()
-
-        def calculate_cost(
-            unconsidered_quantity=total_sell_quantity,
-            row=0,
-            recursive_sum: Decimal = Decimal(),
-        ) -> Decimal:  # type: ignore
-            rows_bought_qty: Decimal = list_of_buy_transactions[row].quantity
-            rows_bought_price: Decimal = list_of_buy_transactions[row].unit_price
-
-            if unconsidered_quantity <= rows_bought_qty:
-                recursive_sum += unconsidered_quantity * rows_bought_price
-                return recursive_sum
-            elif unconsidered_quantity > rows_bought_qty:
-                recursive_sum += rows_bought_qty * rows_bought_price
-                unconsidered_quantity -= rows_bought_qty
-                return calculate_cost(unconsidered_quantity, row + 1, recursive_sum)
-
-        initial_cost_of_stocks_that_are_sold: Decimal = calculate_cost()
-
-        total_cost = (
-            initial_cost_of_all_bought_stocks - initial_cost_of_stocks_that_are_sold
+        # Deleting the lots also deletes their consumptions.
+        self.lot_set.all().delete()  # type: ignore
+        self.replay(transactions, FifoBook())
+
+    def apply_transaction(self, transaction):
+        """
+        Applies a new transaction to the open lots of the holding, instead of recalculating
+        the whole transaction history. Only the lots that a sell consumes are loaded.
+        Back-dated transactions change the order lots are consumed in, so only the
+        transactions from the back-dated transaction onwards are replayed.
+        """
+        latest_transaction = (
+            self.transaction_set.exclude(id=transaction.id)  # type: ignore
+            .order_by("-datetime", "-id")
+            .first()
+        )
+        if latest_transaction and (
+            latest_transaction.datetime,
+            latest_transaction.id,
+        ) > (transaction.datetime, transaction.id):
+            return self.rewind(transaction)
+
+        book = self.get_book(latest_transaction)
+        if book is None:
+            return self.update_instance()
+
+        self.replay(
+            [
+                (
+                    transaction.id,
+                    transaction.direction,
+                    transaction.quantity,
+                    transaction.unit_price,
+                    transaction.datetime,
+                )
+            ],
+            book,
         )
 
-        if total_quantity > 0:
-            self.current_quantity = total_quantity
-            self.average_cost_price = total_cost / total_quantity
-        else:  # If else is to prevent the ZeroDivisionError, where total_quantity = 0.
-            # Completely closed position.
-            self.current_quantity = 0
-            self.average_cost_price = 0
+    def remove_transaction(self, transaction):
+        """
+        Deletes a transaction of the holding, replaying only the transactions after it,
+        with the holding locked.
+        """
+        with db_transaction.atomic():
+            owned_stock = OwnedStock.objects.filter(pk=self.pk).lock()[0]
+            JournalEvent.trade_deleted(transaction).save()
+            owned_stock.rewind(transaction, delete=True)
 
-        # To calculate Realised Profits and Losses
-        if total_sell_quantity == 0:
-            self.save()
-            return
+        self.refresh_from_db()
 
-        total_revenue: Decimal = sum(
-            transaction.unit_price * transaction.quantity
-            for transaction in self.transaction_set.filter(direction="sell")  # type: ignore
+    def rewind(self, transaction, delete=False):
+        """
+        Rewinds the lots of the holding to just before the transaction, and replays the transactions
+        from then on, starting from the position checkpointed by the transaction before it.
+        The transaction is deleted before replaying if delete is True.
+        """
+        after_transaction = self.after(transaction)
+        later_transactions = self.transaction_set.filter(after_transaction)  # type: ignore
+        later_ids = later_transactions.values("id")
+
+        # Give back the quantities that the later sells consumed from earlier lots.
+        consumptions = LotConsumption.objects.filter(transaction__in=later_ids)
+        earlier_lot_consumptions = list(
+            consumptions.exclude(lot__in=later_ids).values_list("lot", "quantity")
+        )
+        restored_lots = Lot.objects.in_bulk(
+            {lot_id for lot_id, quantity in earlier_lot_consumptions}
+        )
+        for lot_id, quantity in earlier_lot_consumptions:
+            restored_lots[lot_id].remaining_quantity += quantity
+        Lot.objects.bulk_update(restored_lots.values(), ["remaining_quantity"])
+
+        consumptions.delete()
+        # Deleting the later lots also deletes the consumptions of earlier oversold sells that they covered.
+        Lot.objects.filter(transaction__in=later_ids).delete()
+
+        if delete:
+            transaction.delete()
+
+        transactions = list(
+            later_transactions.order_by("datetime", "id").values_list(
+                "id", "direction", "quantity", "unit_price", "datetime"
+            )
         )
-        self.realised_pnl = total_revenue - initial_cost_of_stocks_that_are_sold
+        previous_transaction = (
+            self.transaction_set.exclude(after_transaction)  # type: ignore
+            .order_by("-datetime", "-id")
+            .first()
+        )
+
+        book = self.get_book(previous_transaction)
+        if book is None:
+            return self.update_instance()
+
+        self.replay(transactions, book)
+
+    def get_book(self, checkpoint) -> FifoBook | None:
+        """
+        Returns a FifoBook of the position checkpointed by the given transaction, with the open lots loaded lazily.
+        Returns None if the position has to be recalculated from the whole transaction history instead.
+        """
+        if checkpoint is None:
+            return FifoBook()
+
+        # Oversold sells waiting to be covered are rare, so just recalculate everything.
+        if (
+            checkpoint.position_quantity is None
+            or checkpoint.position_oversold_quantity
+        ):
+            return None
+
+        return FifoBook(
+            self.get_open_lots(),
+            realised_pnl=checkpoint.position_realised_pnl,
+            quantity=checkpoint.position_quantity,
+            cost=checkpoint.position_cost,
+        )
+
+    def replay(self, transactions, book: FifoBook):
+        """
+        Applies (id, direction, quantity, unit price, datetime) rows of transactions, ordered by datetime,
+        to the book, then saves the new lots, the lots that were consumed, the position checkpointed
+        after each transaction, and the position.
+        """
+        consumptions = []
+        new_lots = []
+        checkpoints = []
+        for id, direction, quantity, unit_price, transaction_datetime in transactions:
+            consumptions += book.apply(id, direction, quantity, unit_price)
+            checkpoints.append(
+                Transaction(
+                    id=id,
+                    position_quantity=book.quantity,
+                    position_cost=book.cost,
+                    position_realised_pnl=book.realised_pnl,
+                    position_oversold_quantity=book.oversold_quantity,
+                )
+            )
+
+            if direction == "buy":
+                new_lots.append(
+                    Lot(
+                        transaction_id=id,
+                        owned_stock=self,
+                        datetime=transaction_datetime,
+                        unit_price=unit_price,
+                        quantity=quantity,
+                    )
+                )
+        book.close()
+
+        remaining_quantities = book.remaining_quantities()
+        for lot in new_lots:
+            lot.remaining_quantity = remaining_quantities.get(lot.pk, Decimal())
+        Lot.objects.bulk_create(new_lots)
+
+        consumed_lot_ids = {lot_id for sell_id, lot_id, quantity in consumptions}
+        Lot.objects.bulk_update(
+            [
+                Lot(
+                    transaction_id=lot_id,
+                    remaining_quantity=remaining_quantities.get(lot_id, Decimal()),
+                )
+                for lot_id in consumed_lot_ids - {lot.pk for lot in new_lots}
+            ],
+            ["remaining_quantity"],
+        )
+        LotConsumption.objects.bulk_create(
+            LotConsumption(transaction_id=sell_id, lot_id=lot_id, quantity=quantity)
+            for sell_id, lot_id, quantity in consumptions
+        )
+        Transaction.objects.bulk_update(checkpoints, Transaction.CHECKPOINT_FIELDS)
+
+        self.set_position(book)
         self.save()
 
+    def get_open_lots(self):
+        """Lazily loads the open lots of the holding, earliest first, in a single query."""
+        return (
+            self.lot_set.filter(remaining_quantity__gt=0)  # type: ignore
+            .order_by("datetime", "transaction_id")
+            .values_list("transaction_id", "remaining_quantity", "unit_price")
+            .iterator(chunk_size=100)
+        )
+
+    def set_position(self, book: FifoBook):
+        self.current_quantity = book.quantity
+        self.cost_basis = book.cost
+        self.average_cost_price = book.average_cost_price
+        self.oversold_quantity = book.oversold_quantity
+        self.realised_pnl = book.realised_pnl
+
+    @staticmethod
+    def after(transaction) -> Q:
+        """Filters transactions that are ordered at or after the given transaction."""
+        return Q(datetime__gt=transaction.datetime) | Q(
+            datetime=transaction.datetime, id__gte=transaction.id
+        )
+
     @classmethod
     def get_owned_stock(cls, stock: Stock, user: User):
         query = OwnedStock.objects.filter(
@@ -373,8 +851,39 @@ class Transaction(models.Model):
     quantity = PositiveDecimalField(max_digits=10, decimal_places=2)
     direction = models.CharField(max_length=10, choices=DIRECTION_CHOICES)
 
+    # Position of the holding after this transaction, so that back-dated changes only replay the later transactions.
+    position_quantity = models.DecimalField(
+        max_digits=10, decimal_places=2, null=True, editable=False
+    )
+    position_cost = models.DecimalField(
+        max_digits=14, decimal_places=4, null=True, editable=False
+    )
+    position_realised_pnl = models.DecimalField(
+        max_digits=14, decimal_places=4, null=True, editable=False
+    )
+    position_oversold_quantity = models.DecimalField(
+        max_digits=10, decimal_places=2, null=True, editable=False
+    )
+    CHECKPOINT_FIELDS = [
+        "position_quantity",
+        "position_cost",
+        "position_realised_pnl",
+        "position_oversold_quantity",
+    ]
+
     class Meta:
         ordering = ["datetime"]
+        indexes = [
+            # Replaying a holding's transactions in order, and finding its latest one.
+            models.Index(
+                fields=["owned_stock", "datetime", "id"],
+                name="transaction_holding_order_idx",
+            ),
+            # Paging through and exporting a user's history, latest first.
+            models.Index(
+                fields=["user", "datetime", "id"], name="transaction_user_order_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user.email} {self.direction}s {self.quantity} {self.owned_stock.stock.ticker}s at {self.unit_price} each."
@@ -393,25 +902,82 @@ class TransactionManager:
         """
         Creates OwnedStock, use it to create Transaction object, and updates
         OwnedStock object's quantity and average cost price attributes.
+
+        The holding is locked for the whole booking, so that concurrent bookings for
+        it cannot calculate from the same history and overwrite each other.
         """
-        # Create OwnedStock if not created
-        owned_stock, created = OwnedStock.objects.get_or_create(user=user, stock=stock)
-
-        # Create Transaction
-        transaction = Transaction.objects.create(
-            user=user,
-            owned_stock=owned_stock,
-            datetime=datetime,
-            unit_price=unit_price,
-            quantity=quantity,
-            direction=direction,
-        )
+        with db_transaction.atomic():
+            # Create OwnedStock if not created
+            owned_stock = OwnedStock.objects.lock_or_create(user=user, stock=stock)
+
+            # Create Transaction
+            transaction = Transaction.objects.create(
+                user=user,
+                owned_stock=owned_stock,
+                datetime=datetime,
+                unit_price=unit_price,
+                quantity=quantity,
+                direction=direction,
+            )
 
-        owned_stock.update_instance()
+            owned_stock.apply_transaction(transaction)
+            JournalEvent.trade(transaction).save()
 
         return transaction, owned_stock
 
 
+class Lot(models.Model):
+    """
+    A buy transaction's quantity that has yet to be sold, so that sells consume
+    the earliest open lots without going through the whole transaction history.
+    """
+
+    transaction = models.OneToOneField(
+        Transaction, on_delete=models.CASCADE, primary_key=True
+    )
+    owned_stock = models.ForeignKey(OwnedStock, on_delete=models.CASCADE)
+    datetime = models.DateTimeField()
+    unit_price = PositiveDecimalField(max_digits=10, decimal_places=2)
+    quantity = PositiveDecimalField(max_digits=10, decimal_places=2)
+    remaining_quantity = PositiveDecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        ordering = ["datetime", "transaction_id"]
+        indexes = [
+            # Covers the scan of a holding's open lots in get_open_lots(), in order, so
+            # that it reads neither closed lots nor the table. SQLite has no INCLUDE,
+            # so the selected remaining_quantity and unit_price are part of the key.
+            models.Index(
+                fields=[
+                    "owned_stock",
+                    "datetime",
+                    "transaction",
+                    "remaining_quantity",
+                    "unit_price",
+                ],
+                condition=Q(remaining_quantity__gt=0),
+                name="lot_open_scan_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.remaining_quantity} of {self.quantity} bought at {self.unit_price} each are still open."
+
+
+class LotConsumption(models.Model):
+    """
+    The quantity of a lot that a sell consumed, so that the sell can be rewound
+    without going through the whole transaction history.
+    """
+
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE)
+    lot = models.ForeignKey(Lot, on_delete=models.CASCADE)
+    quantity = PositiveDecimalField(max_digits=10, decimal_places=2)
+
+    def __str__(self):
+        return f"Transaction {self.transaction_id} sold {self.quantity} from the lot of transaction {self.lot_id}."  # type: ignore
+
+
 class Transfer(models.Model):
     METHODS = [("withdrawal", "Withdrawal"), ("deposit", "Deposit"), ("set", "Set")]
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -421,5 +987,265 @@ class Transfer(models.Model):
     new_cash = PositiveDecimalField(max_digits=10, decimal_places=2)
     datetime = models.DateTimeField()
 
+    class Meta:
+        indexes = [
+            # Paging through and exporting a user's transfers, latest first.
+            models.Index(
+                fields=["user", "datetime", "id"], name="transfer_user_order_idx"
+            ),
+        ]
+
     def __str__(self):
         return f"{self.user.email} {self.method}"
+
+
+class PortfolioSnapshot(models.Model):
+    """A user's cash, value of holdings and net account value at the close of a day."""
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    date = models.DateField()
+    cash = models.DecimalField(max_digits=14, decimal_places=2)
+    value = models.DecimalField(max_digits=14, decimal_places=2)
+    nav = models.DecimalField(max_digits=14, decimal_places=2)
+
+    class Meta:
+        # The unique constraint's index on (user, date) serves equity curve range scans.
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "date"], name="unique_portfolio_snapshot"
+            )
+        ]
+        ordering = ["user", "date"]
+
+    @staticmethod
+    def start_of(date):
+        return timezone.make_aware(datetime.combine(date, time()))
+
+    @classmethod
+    def take(cls, user, until=None, since=None) -> int:
+        """
+        Snapshots the user's portfolio at the close of every day after their last snapshot
+        (or their first transaction or transfer) up to until, yesterday by default.
+        Snapshots from since onwards are taken again, e.g. after a backdated transaction.
+
+        Starts from the cash and holdings of the last snapshot, so that only the
+        transactions, transfers and closes of the new days are read. Holdings are valued
+        at their stock's last close, or current price if it has no close yet.
+        Returns the number of snapshots taken.
+        """
+        until = until or timezone.localdate() - timedelta(days=1)
+        snapshots = cls.objects.filter(user=user)
+        if since:
+            snapshots.filter(date__gte=since).delete()
+
+        last = snapshots.order_by("-date").first()
+        if last:
+            start = last.date + timedelta(days=1)
+            cash = last.cash
+            holdings = list(
+                last.holdingsnapshot_set.values_list("stock_id", "quantity", "close")
+            )
+            quantities = {stock_id: quantity for stock_id, quantity, close in holdings}
+            closes = {stock_id: close for stock_id, quantity, close in holdings}
+        else:
+            firsts = [
+                model.objects.filter(user=user).aggregate(first=models.Min("datetime"))[
+                    "first"
+                ]
+                for model in [Transaction, Transfer]
+            ]
+            first = min((first for first in firsts if first), default=None)
+            if not first:
+                return 0
+            start = timezone.localdate(first)
+            cash = Decimal()
+            quantities = {}
+            closes = {}
+
+        if start > until:
+            return 0
+
+        period = Q(datetime__gte=cls.start_of(start)) & Q(
+            datetime__lt=cls.start_of(until + timedelta(days=1))
+        )
+        transactions = deque(
+            Transaction.objects.filter(period, user=user)
+            .order_by("datetime", "id")
+            .values_list("datetime", "owned_stock__stock_id", "position_quantity")
+        )
+        transfers = deque(
+            Transfer.objects.filter(period, user=user)
+            .order_by("datetime", "id")
+            .values_list("datetime", "new_cash")
+        )
+
+        stock_ids = set(quantities) | {stock_id for _, stock_id, _ in transactions}
+        daily_closes = deque(
+            DailyPrice.objects.filter(
+                stock_id__in=stock_ids, date__range=(start, until)
+            )
+            .order_by("date")
+            .values_list("date", "stock_id", "close")
+        )
+        # The last close before the first new day of stocks that were not in the last snapshot.
+        for stock_id, close, price in Stock.objects.filter(
+            id__in=stock_ids - set(closes)
+        ).values_list(
+            "id",
+            Subquery(
+                DailyPrice.objects.filter(stock=OuterRef("id"), date__lt=start)
+                .order_by("-date")
+                .values("close")[:1]
+            ),
+            "_price",
+        ):
+            closes[stock_id] = price if close is None else close
+
+        new_snapshots = []
+        new_holdings = []
+        day = start
+        while day <= until:
+            end = cls.start_of(day + timedelta(days=1))
+            while transactions and transactions[0][0] < end:
+                _, stock_id, quantity = transactions.popleft()
+                quantities[stock_id] = quantity or Decimal()
+            while transfers and transfers[0][0] < end:
+                cash = transfers.popleft()[1]
+            while daily_closes and daily_closes[0][0] <= day:
+                _, stock_id, close = daily_closes.popleft()
+                closes[stock_id] = close
+
+            snapshot = cls(user=user, date=day, cash=cash)
+            holdings = [
+                HoldingSnapshot(
+                    snapshot=snapshot,
+                    stock_id=stock_id,
+                    quantity=quantity,
+                    close=closes[stock_id],
+                    value=quantity * closes[stock_id],
+                )
+                for stock_id, quantity in quantities.items()
+                if quantity > 0
+            ]
+            snapshot.value = sum((holding.value for holding in holdings), Decimal())
+            snapshot.nav = snapshot.value + cash
+
+            new_snapshots.append(snapshot)
+            new_holdings.extend(holdings)
+            day += timedelta(days=1)
+
+        with db_transaction.atomic():
+            cls.objects.bulk_create(new_snapshots, batch_size=500)
+            HoldingSnapshot.objects.bulk_create(new_holdings, batch_size=500)
+
+        return len(new_snapshots)
+
+    def __str__(self):
+        return f"{self.user.email} had {self.nav} on {self.date}."
+
+
+class HoldingSnapshot(models.Model):
+    """The quantity and value of a stock held in a portfolio snapshot."""
+
+    snapshot = models.ForeignKey(PortfolioSnapshot, on_delete=models.CASCADE)
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE)
+    quantity = PositiveDecimalField(max_digits=10, decimal_places=2)
+    close = PositiveDecimalField(max_digits=10, decimal_places=2)
+    value = models.DecimalField(max_digits=14, decimal_places=2)
+
+    def __str__(self):
+        return f"{self.quantity} {self.stock.ticker} worth {self.value} on {self.snapshot.date}."
+
+
+class JournalEvent(models.Model):
+    """
+    An append-only record of something that changed a user's positions or cash, from
+    which their positions and cash can be rebuilt (see base/journal.py).
+    Events are ordered by their id, and are never changed once recorded.
+    """
+
+    TRADE = "trade"
+    TRADE_DELETED = "trade_deleted"
+    TRANSFER = "transfer"
+    CORRECTION = "correction"
+    KINDS = [
+        (TRADE, "Trade"),
+        (TRADE_DELETED, "Trade deleted"),
+        (TRANSFER, "Transfer"),
+        (CORRECTION, "Correction"),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=KINDS)
+    # The stock that a trade event is for, so that its trades can be looked up.
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE, null=True, blank=True)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    recorded_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["id"]
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None and not self._state.adding:
+            raise ValueError("Journal events cannot be changed once recorded.")
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def trade(transaction) -> "JournalEvent":
+        return JournalEvent(
+            user_id=transaction.user_id,
+            kind=JournalEvent.TRADE,
+            stock_id=transaction.owned_stock.stock_id,
+            payload={
+                "id": transaction.id,
+                # Full precision, since the encoder would drop the microseconds.
+                "datetime": transaction.datetime.isoformat(),
+                "direction": transaction.direction,
+                "quantity": transaction.quantity,
+                "unit_price": transaction.unit_price,
+            },
+        )
+
+    @staticmethod
+    def trade_deleted(transaction) -> "JournalEvent":
+        return JournalEvent(
+            user_id=transaction.user_id,
+            kind=JournalEvent.TRADE_DELETED,
+            stock_id=transaction.owned_stock.stock_id,
+            payload={"id": transaction.id},
+        )
+
+    @staticmethod
+    def transfer(transfer) -> "JournalEvent":
+        return JournalEvent(
+            user_id=transfer.user_id,
+            kind=JournalEvent.TRANSFER,
+            payload={
+                "method": transfer.method,
+                "value": transfer.value,
+                "old_cash": transfer.old_cash,
+                "new_cash": transfer.new_cash,
+            },
+        )
+
+    def __str__(self):
+        return f"{self.id}: {self.kind} by {self.user_id}"
+
+
+class JournalSnapshot(models.Model):
+    """
+    A user's positions and cash after every journal event up to and including
+    last_event_id, so that rebuilding them only replays the events after it.
+    """
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    last_event_id = models.BigIntegerField()
+    state = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["user", "last_event_id"]
+        indexes = [models.Index(fields=["user", "last_event_id"])]
+
+    def __str__(self):
+        return f"{self.user_id}'s journal up to event {self.last_event_id}"
@@ -0,0 +1,40 @@
+from datetime import datetime
+
+from django.db.models import Q
+
+
+def keyset_page(queryset, cursor: str | None, page_size: int):
+    """
+    Returns a page of queryset, latest (datetime, id) first, starting after cursor, and
+    the cursor of the next page (None if it is the last page).
+
+    Unlike offsets, a cursor ("<datetime in ISO format>_<id>" of the last row of the
+    previous page) lets the database seek straight to the page, so later pages are as
+    fast to load as the first. An invalid cursor is treated as the first page.
+    """
+    # Fetch an extra row, to know whether there is a next page.
+    rows = list(after_cursor(queryset, cursor)[: page_size + 1])
+    if len(rows) <= page_size:
+        return rows, None
+
+    rows = rows[:page_size]
+    return rows, f"{rows[-1].datetime.isoformat()}_{rows[-1].id}"
+
+
+def after_cursor(queryset, cursor: str | None):
+    """Orders queryset latest (datetime, id) first, and keeps the rows after cursor."""
+    queryset = queryset.order_by("-datetime", "-id")
+
+    if cursor:
+        try:
+            last_datetime, last_id = cursor.rsplit("_", 1)
+            last_datetime, last_id = datetime.fromisoformat(last_datetime), int(last_id)
+        except ValueError:
+            pass
+        else:
+            queryset = queryset.filter(
+                Q(datetime__lt=last_datetime)
+                | Q(datetime=last_datetime, id__lt=last_id)
+            )
+
+    return queryset
@@ -0,0 +1,142 @@
+from collections import deque
+from decimal import Decimal
+
+
+class FifoBook:
+    """
+    Keeps track of the open buy lots of a single holding, where the earliest
+    bought lot is the first to be sold.
+
+    Each open lot is a [key, remaining quantity, unit price] list, where key
+    identifies the buy transaction that opened the lot. Each oversold sell is a
+    [key, uncovered quantity] list, for sells of stocks that were not bought yet.
+
+    If the quantity and cost of the open lots are given, lots are loaded lazily
+    from the lots iterable, only when a sell consumes them.
+    """
+
+    def __init__(
+        self,
+        lots=(),
+        oversold=(),
+        realised_pnl=Decimal(),
+        quantity: Decimal | None = None,
+        cost: Decimal | None = None,
+    ):
+        self.lots = deque()
+        self.unloaded_lots = iter(lots)
+        self.bought_lots = deque()
+
+        if quantity is None or cost is None:
+            self.lots.extend(list(lot) for lot in self.unloaded_lots)
+            quantity = sum((lot[1] for lot in self.lots), Decimal())
+            cost = sum((lot[1] * lot[2] for lot in self.lots), Decimal())
+
+        self.quantity = quantity
+        self.cost = cost
+        self.oversold = deque([key, uncovered] for key, uncovered in oversold)
+        self.realised_pnl = realised_pnl
+
+    @property
+    def average_cost_price(self) -> Decimal:
+        if self.quantity > 0:
+            return self.cost / self.quantity
+        # Completely closed position.
+        return Decimal()
+
+    @property
+    def oversold_quantity(self) -> Decimal:
+        return sum((uncovered for key, uncovered in self.oversold), Decimal())
+
+    def first_lot(self) -> list | None:
+        """Returns the earliest open lot, loading it if it has yet to be loaded."""
+        if not self.lots:
+            lot = next(self.unloaded_lots, None)
+            if lot is not None:
+                self.lots.append(list(lot))
+            elif self.bought_lots:
+                self.lots.append(self.bought_lots.popleft())
+            else:
+                return None
+
+        return self.lots[0]
+
+    def buy(self, key, quantity: Decimal, unit_price: Decimal) -> list[tuple]:
+        """
+        Opens a new lot, after covering the earliest oversold sells first.
+        Returns a list of (sell key, lot key, quantity) for each oversold sell that was covered.
+        """
+        consumptions = []
+        remaining = quantity
+
+        while remaining and self.oversold:
+            sell = self.oversold[0]
+            covered = min(sell[1], remaining)
+
+            sell[1] -= covered
+            remaining -= covered
+            self.realised_pnl -= covered * unit_price
+            consumptions.append((sell[0], key, covered))
+
+            if not sell[1]:
+                self.oversold.popleft()
+
+        if remaining:
+            self.bought_lots.append([key, remaining, unit_price])
+            self.quantity += remaining
+            self.cost += remaining * unit_price
+
+        return consumptions
+
+    def sell(self, key, quantity: Decimal, unit_price: Decimal) -> list[tuple]:
+        """
+        Consumes the earliest open lots first.
+        Returns a list of (sell key, lot key, quantity) for each lot that the sell consumed.
+        """
+        consumptions = []
+        unconsidered_quantity = quantity
+        self.realised_pnl += quantity * unit_price
+
+        while unconsidered_quantity > 0:
+            lot = self.first_lot()
+            if lot is None:
+                break
+
+            taken = min(unconsidered_quantity, lot[1])
+
+            lot[1] -= taken
+            unconsidered_quantity -= taken
+            self.quantity -= taken
+            self.cost -= taken * lot[2]
+            self.realised_pnl -= taken * lot[2]
+            consumptions.append((key, lot[0], taken))
+
+            if not lot[1]:
+                self.lots.popleft()
+
+        if unconsidered_quantity:
+            self.oversold.append([key, unconsidered_quantity])
+
+        return consumptions
+
+    def apply(self, key, direction: str, quantity: Decimal, unit_price: Decimal):
+        if direction == "buy":
+            return self.buy(key, quantity, unit_price)
+        return self.sell(key, quantity, unit_price)
+
+    def close(self):
+        """Stops loading lots, closing the underlying database cursor if there is one."""
+        if hasattr(self.unloaded_lots, "close"):
+            self.unloaded_lots.close()  # type: ignore
+
+    def open_lots(self) -> list:
+        """Returns every open lot, earliest first, loading the lots that have yet to be loaded."""
+        self.lots.extend(list(lot) for lot in self.unloaded_lots)
+        return [*self.lots, *self.bought_lots]
+
+    def remaining_quantities(self) -> dict:
+        """Maps the key of each loaded or newly bought open lot to its remaining quantity."""
+        return {
+            key: remaining
+            for key, remaining, unit_price in (*self.lots, *self.bought_lots)
+        }
@@ -0,0 +1,242 @@
+import json
+import re
+import sqlite3
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from decimal import Decimal
+from functools import lru_cache
+
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .extract import find_text
+from .http import client
+from .model_choices import EXCHANGE_CHOICES
+
+# Size of the chunks that scraped webpages are read and parsed in.
+CHUNK_SIZE = 16 * 1024
+
+
+class QuoteProvider:
+    """Looks up the latest price of tickers traded on an exchange."""
+
+    def get_price(self, ticker: str, exchange: str) -> Decimal | None:
+        raise NotImplementedError
+
+    def get_prices(
+        self, pairs, max_workers=None
+    ) -> list[Decimal | None | requests.RequestException]:
+        """
+        Looks up the prices of (ticker, exchange) pairs, in the same order.
+        Looks up each pair concurrently on a bounded thread pool, unless a provider
+        can look them up in a single batch.
+
+        A pair's price is None if the ticker is not traded in the exchange, or the
+        requests.RequestException raised if it could not be looked up, so that a
+        failed lookup is not mistaken for a ticker that is not traded there.
+        """
+        pairs = list(pairs)
+        if not pairs:
+            return []
+
+        def fetch(pair):
+            ticker, exchange = pair
+            try:
+                return self.get_price(ticker, exchange)
+            except requests.RequestException as e:
+                print(f"Failed to fetch {ticker}:{exchange}'s price: {e}")
+                return e
+
+        max_workers = min(max_workers or settings.QUOTE_REFRESH_MAX_WORKERS, len(pairs))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(fetch, pairs))
+
+
+class FxProvider:
+    """Looks up the latest currency conversion rate from one currency to another."""
+
+    def get_rate(self, cfrom: str, cto: str) -> Decimal | None:
+        raise NotImplementedError
+
+
+class GoogleFinanceQuoteProvider(QuoteProvider):
+    def get_price(self, ticker, exchange):
+        # URL of GOOGLE FINANCE Page
+        url = f"https://www.google.com/finance/quote/{ticker}:{exchange}"
+
+        # Stream the webpage, and stop parsing it once the latest price is found
+        with client.get(url) as response:
+            latest = find_text(
+                response.iter_content(CHUNK_SIZE, decode_unicode=True),
+                "div",
+                "YMlKec fxKbKc",
+            )
+
+        if latest:
+            match = re.search(r"\d+\.\d{2}", latest)
+        else:
+            print(f"No match for {ticker}:{exchange} in web scraping.")
+            return None
+
+        if match:
+            print(
+                f"Web Scraped {ticker}:{exchange} successfully at the latest price of {latest}."
+            )
+            return Decimal(match.group())
+
+        else:
+            print(f"Web Scraped {ticker}:{exchange} unsuccessfully.")
+            return Decimal()
+
+
+class XeFxProvider(FxProvider):
+    def get_rate(self, cfrom, cto):
+        # URL of the webpage
+        url = f"https://www.xe.com/currencyconverter/convert/?Amount=1&From={cfrom}&To={cto}"
+
+        # Stream the webpage, and stop parsing it once the rate is found
+        with client.get(url) as response:
+            rate = find_text(
+                response.iter_content(CHUNK_SIZE, decode_unicode=True),
+                "p",
+                "sc-1c293993-1 fxoXHw",
+            )
+
+        match = re.match(r"^\d+\.\d+", rate) if rate else None
+
+        if match:
+            print(f"Web Scraped rate {cfrom}{cto} successfully at {match.group()}.")
+            return Decimal(match.group())
+
+        print(f"Web Scraped rate {cfrom}{cto} unsuccessfully.")
+        return None
+
+
+class JsonFileProvider(QuoteProvider, FxProvider):
+    """
+    Serves prices and rates from a local JSON file, such as one written by the
+    dump_market_data command, in the format of
+    {"quotes": {"AAPL:NASDAQ": "189.50"}, "rates": {"USD:SGD": "1.3512"}}
+    """
+
+    def __init__(self, path):
+        with open(path) as file:
+            data = json.load(file)
+
+        self.quotes = {
+            key: Decimal(value) for key, value in data.get("quotes", {}).items()
+        }
+        self.rates = {
+            key: Decimal(value) for key, value in data.get("rates", {}).items()
+        }
+
+    def get_price(self, ticker, exchange):
+        return self.quotes.get(f"{ticker}:{exchange}")
+
+    def get_prices(self, pairs, max_workers=None):
+        return [self.get_price(ticker, exchange) for ticker, exchange in pairs]
+
+    def get_rate(self, cfrom, cto):
+        return self.rates.get(f"{cfrom}:{cto}")
+
+
+class SQLiteProvider(QuoteProvider, FxProvider):
+    """
+    Serves prices and rates from a local SQLite database, with the tables
+    quotes (ticker, exchange, price) and rates (cfrom, cto, rate).
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def query(self, sql, params=()):
+        # A connection per query, since SQLite connections cannot be shared between threads.
+        with closing(sqlite3.connect(self.path)) as connection:
+            return connection.execute(sql, params).fetchall()
+
+    def get_price(self, ticker, exchange):
+        return self.get_prices([(ticker, exchange)])[0]
+
+    def get_prices(self, pairs, max_workers=None):
+        pairs = list(pairs)
+        if not pairs:
+            return []
+
+        conditions = " OR ".join(["(ticker = ? AND exchange = ?)"] * len(pairs))
+        rows = self.query(
+            f"SELECT ticker, exchange, CAST(price AS TEXT) FROM quotes WHERE {conditions}",
+            [value for pair in pairs for value in pair],
+        )
+        prices = {
+            (ticker, exchange): Decimal(price) for ticker, exchange, price in rows
+        }
+
+        return [prices.get(pair) for pair in pairs]
+
+    def get_rate(self, cfrom, cto):
+        rows = self.query(
+            "SELECT CAST(rate AS TEXT) FROM rates WHERE cfrom = ? AND cto = ?",
+            (cfrom, cto),
+        )
+        return Decimal(rows[0][0]) if rows else None
+
+
+class FakeProvider(QuoteProvider, FxProvider):
+    """
+    Makes up deterministic prices and rates without any network access, for tests,
+    benchmarks and load tests. Every ticker is listed on exactly one exchange,
+    and if tickers is given, all other tickers are invalid.
+    """
+
+    def __init__(self, tickers=None):
+        self.tickers = {ticker.upper() for ticker in tickers} if tickers else None
+
+    @staticmethod
+    def checksum(text: str) -> int:
+        return zlib.crc32(text.encode())
+
+    def get_price(self, ticker, exchange):
+        if self.tickers is not None and ticker not in self.tickers:
+            return None
+
+        exchanges = [choice[0] for choice in EXCHANGE_CHOICES]
+        if exchanges[self.checksum(ticker) % len(exchanges)] != exchange:
+            return None
+
+        # Between US$1.00 and US$500.00
+        return Decimal(100 + self.checksum(ticker) % 49900) / 100
+
+    def get_prices(self, pairs, max_workers=None):
+        return [self.get_price(ticker, exchange) for ticker, exchange in pairs]
+
+    def get_rate(self, cfrom, cto):
+        if cfrom == cto:
+            return Decimal(1)
+
+        # Between 0.5 and 2.5
+        return Decimal(5000 + self.checksum(f"{cfrom}{cto}") % 20000) / 10000
+
+
+@lru_cache
+def get_provider(kind: str):
+    """Loads the provider configured for kind ("quotes" or "fx") in settings.MARKET_DATA_PROVIDERS."""
+    config = settings.MARKET_DATA_PROVIDERS[kind]
+    return import_string(config["BACKEND"])(**config.get("OPTIONS", {}))
+
+
+def get_quote_provider() -> QuoteProvider:
+    return get_provider("quotes")
+
+
+def get_fx_provider() -> FxProvider:
+    return get_provider("fx")
+
+
+@receiver(setting_changed)
+def reset_providers(setting, **kwargs):
+    if setting == "MARKET_DATA_PROVIDERS":
+        get_provider.cache_clear()
@@ -0,0 +1,23 @@
+import time
+
+from django.core.cache import cache
+
+
+def is_rate_limited(key: str, limit: int, period: int) -> bool:
+    """
+    Counts a hit on the key, and returns True if the key was hit more than limit times
+    in the current period of seconds. The counts are kept in Django's cache, so that
+    every worker process shares them.
+    """
+    window = int(time.time() // period)
+    cache_key = f"ratelimit:{key}:{window}"
+
+    cache.add(cache_key, 0, timeout=period)
+    try:
+        hits = cache.incr(cache_key)
+    except ValueError:
+        # The count expired between add and incr.
+        cache.set(cache_key, 1, timeout=period)
+        hits = 1
+
+    return hits > limit
@@ -0,0 +1,146 @@
+"""
+Recalculates holdings from their whole transaction history, many users at a time.
+
+OwnedStock.update_instance() does the same for a single holding, with several queries
+and writes per holding. rebuild_users() streams the transactions of a batch of users in
+a single query, ordered by holding and datetime, replays each holding through a
+FifoBook in memory, and writes the positions, lots, lot consumptions and position
+checkpoints back in bulk, in a single database transaction with the holdings locked.
+Batches can be rebuilt in parallel by separate processes (see the rebuild_positions
+command), since they share no holdings. No JournalEvent is recorded, as rebuilding
+changes no position that the journal determines (see base/journal.py).
+"""
+
+from decimal import Decimal
+from itertools import groupby
+
+import django
+from django.db import connection, connections
+from django.db import transaction as db_transaction
+
+# Rows written per query by bulk_create and bulk_update.
+WRITE_BATCH_SIZE = 1000
+
+
+def setup_worker():
+    """Prepares a worker process, which must not share the parent's connections."""
+    django.setup()
+    connections.close_all()
+
+
+def update_by_pk(model, field_names, objs):
+    """
+    Saves the given fields of existing rows, with one parametrised UPDATE executed for
+    every object. Unlike bulk_update(), this builds no CASE expression for every row,
+    which takes most of the time when updating the checkpoints of every transaction.
+    """
+    fields = [model._meta.get_field(name) for name in field_names]
+    quote_name = connection.ops.quote_name
+    sql = "UPDATE {} SET {} WHERE {} = %s".format(
+        quote_name(model._meta.db_table),
+        ", ".join(f"{quote_name(field.column)} = %s" for field in fields),
+        quote_name(model._meta.pk.column),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            sql,
+            [
+                [
+                    field.get_db_prep_save(getattr(obj, field.attname), connection)
+                    for field in fields
+                ]
+                + [obj.pk]
+                for obj in objs
+            ],
+        )
+
+
+def rebuild_users(user_ids, since=None) -> tuple[int, int]:
+    """
+    Rebuilds the holdings of the given users, only those with transactions at or after
+    since (an aware datetime) if it is given. Returns the number of holdings and the
+    number of transactions that were replayed.
+    """
+    # Imported here, since worker processes import this module before setup_worker().
+    from .models import Lot, LotConsumption, OwnedStock, Transaction
+    from .positions import FifoBook
+
+    with db_transaction.atomic():
+        owned_stocks = OwnedStock.objects.filter(user_id__in=user_ids)
+        if since:
+            owned_stocks = owned_stocks.filter(
+                pk__in=Transaction.objects.filter(
+                    user_id__in=user_ids, datetime__gte=since
+                ).values("owned_stock")
+            )
+        owned_stocks = {
+            owned_stock.pk: owned_stock for owned_stock in owned_stocks.lock()
+        }
+        if not owned_stocks:
+            return 0, 0
+
+        transactions = (
+            Transaction.objects.filter(owned_stock__in=owned_stocks.keys())
+            .order_by("owned_stock_id", "datetime", "id")
+            .values_list(
+                "owned_stock", "id", "direction", "quantity", "unit_price", "datetime"
+            )
+            .iterator(chunk_size=WRITE_BATCH_SIZE)
+        )
+
+        lots = []
+        consumptions = []
+        checkpoints = []
+        # Holdings without any transactions are reset to an empty position.
+        books = {owned_stock_id: FifoBook() for owned_stock_id in owned_stocks}
+        for owned_stock_id, rows in groupby(transactions, key=lambda row: row[0]):
+            book = books[owned_stock_id]
+            holding_lots = []
+            for _, id, direction, quantity, unit_price, datetime in rows:
+                consumptions += book.apply(id, direction, quantity, unit_price)
+                checkpoints.append(
+                    Transaction(
+                        id=id,
+                        position_quantity=book.quantity,
+                        position_cost=book.cost,
+                        position_realised_pnl=book.realised_pnl,
+                        position_oversold_quantity=book.oversold_quantity,
+                    )
+                )
+                if direction == "buy":
+                    holding_lots.append(
+                        Lot(
+                            transaction_id=id,
+                            owned_stock_id=owned_stock_id,
+                            datetime=datetime,
+                            unit_price=unit_price,
+                            quantity=quantity,
+                        )
+                    )
+
+            remaining_quantities = book.remaining_quantities()
+            for lot in holding_lots:
+                lot.remaining_quantity = remaining_quantities.get(lot.pk, Decimal())
+            lots += holding_lots
+
+        for owned_stock_id, book in books.items():
+            owned_stocks[owned_stock_id].set_position(book)
+
+        # Deleting the lots also deletes their consumptions.
+        Lot.objects.filter(owned_stock__in=owned_stocks.keys()).delete()
+        Lot.objects.bulk_create(lots, batch_size=WRITE_BATCH_SIZE)
+        LotConsumption.objects.bulk_create(
+            (
+                LotConsumption(transaction_id=sell_id, lot_id=lot_id, quantity=quantity)
+                for sell_id, lot_id, quantity in consumptions
+            ),
+            batch_size=WRITE_BATCH_SIZE,
+        )
+        update_by_pk(Transaction, Transaction.CHECKPOINT_FIELDS, checkpoints)
+        OwnedStock.objects.bulk_update(
+            owned_stocks.values(),
+            OwnedStock.POSITION_FIELDS,
+            batch_size=WRITE_BATCH_SIZE,
+        )
+
+    return len(owned_stocks), len(checkpoints)
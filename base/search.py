@@ -0,0 +1,73 @@
+import requests
+from django.conf import settings
+
+from .cache import LRUCache
+from .models import DailyPrice, Stock
+from .ratelimit import is_rate_limited
+
+# Tickers that were recently found to be invalid, so that searching them again is cheap.
+invalid_tickers = LRUCache(
+    maxsize=settings.INVALID_TICKER_CACHE_SIZE,
+    ttl=settings.EXCHANGE_RESOLUTION_NEGATIVE_TTL,
+)
+
+
+def look_up_stock(user, ticker: str, imported: bool = False):
+    """
+    Returns the stock of the ticker, which is new and unsaved if the ticker was not
+    in the database, and None, or None and the reason that the stock could not be found.
+
+    Looking up a new ticker costs outbound requests, so each user may only look up
+    settings.TICKER_LOOKUP_RATE_LIMIT (limit, period in seconds) new tickers, or
+    settings.TICKER_IMPORT_RATE_LIMIT new tickers that are imported.
+    """
+    ticker = ticker.upper()
+
+    max_length = Stock._meta.get_field("ticker").max_length  # type: ignore
+    if ticker in invalid_tickers or len(ticker) > max_length:
+        return None, "Ticker is invalid."
+
+    stock = Stock.objects.filter(ticker=ticker).first()
+    if stock:
+        return stock, None
+
+    if imported:
+        limit, period = settings.TICKER_IMPORT_RATE_LIMIT
+        if is_rate_limited(f"ticker-import:{user.pk}", limit, period):
+            return (
+                None,
+                "You have imported too many new tickers. Please try again later.",
+            )
+    else:
+        limit, period = settings.TICKER_LOOKUP_RATE_LIMIT
+        if is_rate_limited(f"ticker-lookup:{user.pk}", limit, period):
+            return (
+                None,
+                "You have searched for too many new tickers. Please try again later.",
+            )
+
+    try:
+        stock = Stock.look_up(ticker)
+    except requests.RequestException:
+        # Only tickers that every exchange confirmed to be invalid are remembered.
+        return None, "The ticker could not be looked up. Please try again later."
+
+    if not stock:
+        invalid_tickers.set(ticker, True)
+        return None, "Ticker is invalid."
+
+    return stock, None
+
+
+def find_stock(user, ticker: str):
+    """
+    Returns the stock of the ticker, creating it if the ticker is valid, and None,
+    or None and the reason that the stock could not be found, as look_up_stock does.
+    """
+    stock, error = look_up_stock(user, ticker)
+
+    if stock and stock._state.adding:
+        stock.save()
+        DailyPrice.objects.record([stock])
+
+    return stock, error
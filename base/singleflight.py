@@ -0,0 +1,81 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+# A [lock, number of callers holding or waiting on it] pair per key in use, so that
+# threads of the same process wait on each other.
+key_locks = {}
+key_locks_lock = threading.Lock()
+
+
+@contextmanager
+def hold_key_lock(key):
+    """
+    Holds the key's lock, and yields True if another caller held it first.
+    The lock is dropped once no caller holds or waits on it, so that key_locks
+    only grows with the keys in use.
+    """
+    with key_locks_lock:
+        entry = key_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+
+    lock = entry[0]
+    waited = not lock.acquire(blocking=False)
+    if waited:
+        lock.acquire()
+
+    try:
+        yield waited
+    finally:
+        lock.release()
+        with key_locks_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del key_locks[key]
+
+
+def acquire_lease(key, timeout=None) -> bool:
+    """
+    Takes a lease on the key in Django's cache, which every worker process shares.
+    Returns False if another caller holds the lease. The lease expires after timeout
+    seconds, in case its holder dies without releasing it.
+    """
+    return cache.add(f"lease:{key}", True, timeout or settings.SINGLE_FLIGHT_TIMEOUT)
+
+
+def release_lease(key):
+    cache.delete(f"lease:{key}")
+
+
+def wait_for_lease(key, timeout=None, poll_interval=0.1):
+    """Waits until the lease on the key is released, or timeout seconds have passed."""
+    deadline = time.monotonic() + (timeout or settings.SINGLE_FLIGHT_TIMEOUT)
+    while cache.get(f"lease:{key}") is not None and time.monotonic() < deadline:
+        time.sleep(poll_interval)
+
+
+def single_flight(key, fetch, reload, timeout=None):
+    """
+    Makes sure that only one caller, across threads and worker processes, runs fetch()
+    for the key at a time, instead of every caller fetching the same result at once.
+
+    Callers that had to wait on another caller run reload() afterwards, which reloads the
+    result that the other caller fetched, and returns True if it is usable. If it is not
+    (e.g. the other fetch failed), the caller reuses what it already has.
+    """
+    with hold_key_lock(key) as waited:
+        if waited and reload():
+            return
+
+        if not acquire_lease(key, timeout):
+            wait_for_lease(key, timeout)
+            reload()
+            return
+
+        try:
+            fetch()
+        finally:
+            release_lease(key)
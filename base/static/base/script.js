@@ -17,9 +17,30 @@ if (window.location.pathname === '/history/') {
         let txn = document.querySelector("#txn");
         let trf = document.querySelector("#trf");
 
+        // Transfers are only loaded the first time their tab is opened, a page at a time.
+        let trfPage = document.querySelector("#trf-page");
+        let trfLoaded = false;
+
+        function loadTransfers(url) {
+            fetch(url)
+                .then(response => response.text())
+                .then(html => { trfPage.innerHTML = html; });
+        }
+
         trfBtn.addEventListener('change', function(event) {
             txn.style.display = 'none';
             trf.style.display = 'block';
+
+            if (!trfLoaded) {
+                trfLoaded = true;
+                loadTransfers(trf.dataset.url);
+            }
+        })
+
+        trf.addEventListener('click', function(event) {
+            if (event.target.classList.contains('more-transfers')) {
+                loadTransfers(event.target.dataset.url);
+            }
         })
 
         txnBtn.addEventListener('change', function(event) {
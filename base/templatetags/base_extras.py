@@ -3,7 +3,7 @@ from decimal import Decimal, InvalidOperation
 from django import template
 
 # from ..get_xchange import convert_from
-from ..models import CurrencyConversionRate
+from ..fx import get_rate
 
 register = template.Library()
 
@@ -46,10 +46,7 @@ def minus(x: Decimal, y: Decimal) -> Decimal:
 @register.filter
 def home_currency(value: Decimal, symbol: str) -> str:
 
-    conversion_object, created = CurrencyConversionRate.objects.get_or_create(
-        cfrom="USD", cto=symbol
-    )
-    rate = conversion_object.ccrate
+    rate = get_rate("USD", symbol)
     new_value = rate * value
     try:
         if Decimal(new_value) < 0:
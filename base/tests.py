@@ -1,3 +1,1091 @@
-from django.test import TestCase
+import contextlib
+import io
+import json
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipUnless
+
+import numpy as np
+import requests
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db import transaction as db_transaction
+from django.db.transaction import TransactionManagementError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .analytics import analyse_series
+from .extract import find_text
+from .fx import fx_rates
+from .http import CircuitBreaker, HttpClient, client
+from .imports import import_transactions
+from .journal import rebuild, regenerate, take_snapshot
+from .management.commands.benchmark_indexes import hot_queries
+from .model_choices import EXCHANGE_CHOICES
+from .models import (
+    CurrencyConversionRate,
+    DailyPrice,
+    Lot,
+    LotConsumption,
+    OwnedStock,
+    PortfolioSnapshot,
+    Stock,
+    TickerExchange,
+    Transaction,
+    TransactionManager,
+    Transfer,
+    User,
+)
+from .positions import FifoBook
+from .providers import FakeProvider, QuoteProvider
+from .rebuild import rebuild_users
+from .search import find_stock, invalid_tickers, look_up_stock
+from .singleflight import acquire_lease, key_locks, single_flight
+
 
 # Create your tests here.
+@override_settings(
+    MARKET_DATA_PROVIDERS={
+        "quotes": {"BACKEND": "base.providers.FakeProvider"},
+        "fx": {"BACKEND": "base.providers.FakeProvider"},
+    }
+)
+class PortfolioTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="tester", email="tester@example.com", password="pw", tz="UTC"
+        )
+        CurrencyConversionRate.objects.create(
+            cfrom="USD", cto=self.user.hc, _ccrate=Decimal("1.35")
+        )
+        self.client.force_login(self.user)
+        cache.clear()
+        fx_rates.clear()
+
+    def add_holding(self, ticker):
+        stock = Stock.objects.create(ticker=ticker, exchange="NYSE", _price=Decimal("10"))
+        now = timezone.now()
+        for days, direction in [(3, "buy"), (2, "buy"), (1, "sell")]:
+            TransactionManager.create_transaction_and_update_owned_stock(
+                user=self.user,
+                stock=stock,
+                datetime=now - timedelta(days=days),
+                unit_price=Decimal("5"),
+                quantity=Decimal("2"),
+                direction=direction,
+            )
+
+
+class RefreshPricesTest(PortfolioTestCase):
+    def stale_stocks(self, *tickers):
+        exchanges = [choice[0] for choice in EXCHANGE_CHOICES]
+        for ticker in tickers:
+            exchange = next(e for e in exchanges if FakeProvider().get_price(ticker, e))
+            Stock.objects.create(ticker=ticker, exchange=exchange, _price=Decimal("10"))
+        Stock.objects.update(last_updated=timezone.now() - timedelta(days=2))
+        return [Stock.objects.get(ticker=ticker) for ticker in tickers]
+
+    def test_stale_prices_are_saved_with_a_single_bulk_update(self):
+        stocks = self.stale_stocks("AAA", "IBM", "KO")
+
+        with mock.patch.object(
+            Stock.objects, "bulk_update", wraps=Stock.objects.bulk_update
+        ) as bulk_update:
+            self.assertEqual(Stock.refresh_prices(stocks), stocks)
+
+        bulk_update.assert_called_once()
+        self.assertEqual(bulk_update.call_args.args[0], stocks)
+        for stock in stocks:
+            stock.refresh_from_db()
+            self.assertEqual(
+                stock._price, FakeProvider().get_price(stock.ticker, stock.exchange)
+            )
+            self.assertFalse(stock.is_price_stale())
+
+    def test_each_ticker_is_fetched_once(self):
+        stock, other = self.stale_stocks("AAA", "KO")
+        provider = FakeProvider()
+
+        with mock.patch("base.models.get_quote_provider", return_value=provider):
+            with mock.patch.object(
+                provider, "get_prices", wraps=provider.get_prices
+            ) as get_prices:
+                updated = Stock.refresh_prices(
+                    [stock, other, Stock.objects.get(pk=stock.pk), stock]
+                )
+
+        self.assertEqual(len(updated), 2)
+        get_prices.assert_called_once()
+        self.assertEqual(
+            get_prices.call_args.args[0],
+            [(stock.ticker, stock.exchange), (other.ticker, other.exchange)],
+        )
+
+    def test_a_failed_lookup_keeps_its_stored_price(self):
+        stocks = self.stale_stocks("AAA", "IBM", "KO")
+        failing = stocks[1]
+
+        provider = FlakyProvider([failing.exchange])
+        with mock.patch("base.models.get_quote_provider", return_value=provider):
+            updated = Stock.refresh_prices(stocks)
+
+        # The lookups after the failed one are still saved.
+        self.assertEqual(updated, [stocks[0], stocks[2]])
+        failing.refresh_from_db()
+        self.assertEqual(failing._price, Decimal("10"))
+        self.assertTrue(failing.is_price_stale())
+        self.assertFalse(Stock.objects.get(ticker="KO").is_price_stale())
+
+
+class RefreshQuotesTest(PortfolioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_holding("AAA")
+        Stock.objects.create(ticker="KO", exchange="NYSE", _price=Decimal("10"))
+        Stock.objects.update(last_updated=timezone.now() - timedelta(days=2))
+
+    def test_refresh_quotes_refreshes_held_stocks_first(self):
+        out = io.StringIO()
+        with mock.patch.object(
+            Stock, "refresh_prices", wraps=Stock.refresh_prices
+        ) as refresh_prices:
+            call_command("refresh_quotes", "--once", stdout=out)
+
+        held, others = [call.args[0] for call in refresh_prices.call_args_list]
+        self.assertEqual([stock.ticker for stock in held], ["AAA"])
+        self.assertEqual([stock.ticker for stock in others], ["KO"])
+        self.assertIn("Refreshed 1 held and 1 other stock prices.", out.getvalue())
+        self.assertFalse(any(stock.is_price_stale() for stock in Stock.objects.all()))
+
+    def test_pages_fetch_stale_prices_inline_by_default(self):
+        with mock.patch(
+            "base.models.get_quote_provider", return_value=FakeProvider()
+        ) as get_quote_provider:
+            self.client.get(reverse("base:home"))
+        get_quote_provider.assert_called()
+
+    @override_settings(BACKGROUND_QUOTE_REFRESH=True)
+    def test_pages_read_stored_prices_when_refreshed_in_the_background(self):
+        with mock.patch("base.models.get_quote_provider") as get_quote_provider:
+            home = self.client.get(reverse("base:home"))
+            summary = self.client.get(reverse("base:api-portfolio"))
+
+        get_quote_provider.assert_not_called()
+        self.assertContains(home, "AAA")
+        # 2 stocks held, at the stored price of 10 each.
+        self.assertEqual(summary.json()["total_value"], "20")
+
+
+class FifoBookTest(PortfolioTestCase):
+    def test_sells_consume_the_earliest_lots_first(self):
+        book = FifoBook()
+        self.assertEqual(book.buy(1, Decimal("10"), Decimal("5")), [])
+        book.buy(2, Decimal("10"), Decimal("7"))
+
+        # Consumes all of the first lot, and part of the second.
+        self.assertEqual(
+            book.sell(3, Decimal("15"), Decimal("8")),
+            [(3, 1, Decimal("10")), (3, 2, Decimal("5"))],
+        )
+        self.assertEqual(book.remaining_quantities(), {2: Decimal("5")})
+        self.assertEqual((book.quantity, book.cost), (Decimal("5"), Decimal("35")))
+        self.assertEqual(book.average_cost_price, Decimal("7"))
+        self.assertEqual(book.realised_pnl, Decimal("35"))
+
+        self.assertEqual(
+            book.sell(4, Decimal("5"), Decimal("6")), [(4, 2, Decimal("5"))]
+        )
+        self.assertEqual(book.remaining_quantities(), {})
+        self.assertEqual((book.quantity, book.cost), (Decimal(), Decimal()))
+        self.assertEqual(book.average_cost_price, Decimal())
+        self.assertEqual(book.realised_pnl, Decimal("30"))
+
+    def test_buys_cover_oversold_sells_first(self):
+        book = FifoBook()
+        self.assertEqual(book.sell(1, Decimal("4"), Decimal("10")), [])
+        self.assertEqual(book.oversold_quantity, Decimal("4"))
+        self.assertEqual(book.quantity, Decimal())
+
+        self.assertEqual(
+            book.buy(2, Decimal("6"), Decimal("7")), [(1, 2, Decimal("4"))]
+        )
+        self.assertEqual(book.oversold_quantity, Decimal())
+        self.assertEqual(book.remaining_quantities(), {2: Decimal("2")})
+        self.assertEqual((book.quantity, book.cost), (Decimal("2"), Decimal("14")))
+        self.assertEqual(book.realised_pnl, Decimal("12"))
+
+    def test_cost_basis_and_average_cost_price_are_rounded_when_saved(self):
+        stock = Stock.objects.create(ticker="AAA", exchange="NYSE", _price=Decimal("1"))
+        now = timezone.now()
+        for days, unit_price, quantity, direction in [
+            (3, "1.01", "3", "buy"),
+            (2, "1.02", "4", "buy"),
+            (1, "1.50", "2", "sell"),
+        ]:
+            transaction, owned_stock = (
+                TransactionManager.create_transaction_and_update_owned_stock(
+                    self.user,
+                    stock,
+                    now - timedelta(days=days),
+                    Decimal(unit_price),
+                    Decimal(quantity),
+                    direction,
+                )
+            )
+
+        # 1 bought at 1.01 and 4 at 1.02 are still open.
+        book = FifoBook(owned_stock.get_open_lots())
+        self.assertEqual(book.cost, Decimal("5.09"))
+        self.assertEqual(book.average_cost_price, Decimal("1.018"))
+
+        owned_stock.refresh_from_db()
+        self.assertEqual(owned_stock.cost_basis, Decimal("5.0900"))
+        self.assertEqual(owned_stock.average_cost_price, Decimal("1.02"))
+        self.assertEqual(owned_stock.realised_pnl, Decimal("0.98"))
+
+
+class PositionReplayTest(PortfolioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.stock = Stock.objects.create(
+            ticker="AAA", exchange="NYSE", _price=Decimal("10")
+        )
+        self.now = timezone.now()
+
+    def book(self, days, direction, quantity, unit_price):
+        transaction, owned_stock = (
+            TransactionManager.create_transaction_and_update_owned_stock(
+                self.user,
+                self.stock,
+                self.now - timedelta(days=days),
+                Decimal(unit_price),
+                Decimal(quantity),
+                direction,
+            )
+        )
+        return transaction, owned_stock
+
+    def state(self, owned_stock):
+        owned_stock.refresh_from_db()
+        return (
+            [getattr(owned_stock, field) for field in OwnedStock.POSITION_FIELDS],
+            sorted(
+                owned_stock.lot_set.values_list("transaction", "remaining_quantity")
+            ),
+            sorted(
+                LotConsumption.objects.filter(lot__owned_stock=owned_stock).values_list(
+                    "transaction", "lot", "quantity"
+                )
+            ),
+            self.checkpoints(owned_stock),
+        )
+
+    def checkpoints(self, owned_stock):
+        return {
+            checkpoint[0]: checkpoint[1:]
+            for checkpoint in owned_stock.transaction_set.values_list(
+                "id", *Transaction.CHECKPOINT_FIELDS
+            )
+        }
+
+    def assertMatchesFullReplay(self, owned_stock):
+        state = self.state(owned_stock)
+        owned_stock.update_instance()
+        self.assertEqual(state, self.state(owned_stock))
+
+    def test_back_dated_transactions_match_a_full_replay(self):
+        self.book(10, "buy", "5", "4")
+        transaction, owned_stock = self.book(6, "sell", "3", "6")
+        self.book(2, "buy", "4", "5")
+        self.book(1, "sell", "4", "7")
+        self.assertMatchesFullReplay(owned_stock)
+
+        # Back-dated before the first sell, so that it consumes a different lot.
+        # Only the transactions from then on are replayed.
+        with mock.patch.object(
+            OwnedStock, "update_instance", side_effect=AssertionError
+        ):
+            self.book(8, "buy", "2", "3")
+        self.assertMatchesFullReplay(owned_stock)
+
+        # Back-dated before every buy, so that it is oversold until the first buy.
+        self.book(12, "sell", "1", "8")
+        self.assertMatchesFullReplay(owned_stock)
+
+        owned_stock.refresh_from_db()
+        self.assertEqual(owned_stock.current_quantity, Decimal("3"))
+        self.assertEqual(owned_stock.oversold_quantity, Decimal())
+
+    def test_deleting_a_middle_transaction_matches_a_full_replay(self):
+        self.book(10, "buy", "5", "4")
+        middle, owned_stock = self.book(8, "buy", "2", "3")
+        self.book(6, "sell", "6", "6")
+        self.book(2, "buy", "4", "5")
+        self.book(1, "sell", "2", "7")
+
+        # The later sell consumed part of the deleted lot.
+        owned_stock.remove_transaction(middle)
+        self.assertMatchesFullReplay(owned_stock)
+
+        # Deleting the buy that the first sell consumed leaves it oversold.
+        first = owned_stock.transaction_set.earliest("datetime")
+        owned_stock.remove_transaction(first)
+        self.assertMatchesFullReplay(owned_stock)
+        self.assertEqual(owned_stock.current_quantity, Decimal())
+        self.assertEqual(owned_stock.oversold_quantity, Decimal("4"))
+
+    def test_checkpoints_after_a_back_dated_transaction_are_rewritten(self):
+        earlier, owned_stock = self.book(10, "buy", "5", "4")
+        later, owned_stock = self.book(6, "sell", "3", "6")
+        before = self.checkpoints(owned_stock)
+        self.assertEqual(
+            before[later.id], (Decimal("2"), Decimal("8"), Decimal("6"), Decimal())
+        )
+
+        self.book(8, "buy", "2", "3")
+
+        after = self.checkpoints(owned_stock)
+        self.assertEqual(after[earlier.id], before[earlier.id])
+        # The sell now leaves 2 bought at 4 and 2 bought at 3 open.
+        self.assertEqual(
+            after[later.id], (Decimal("4"), Decimal("14"), Decimal("6"), Decimal())
+        )
+        # Replaying from the checkpoint gives the same result as a full replay.
+        self.assertMatchesFullReplay(owned_stock)
+
+
+class HomeQueryCountTest(PortfolioTestCase):
+    def test_home_queries_do_not_grow_with_holdings(self):
+        self.add_holding("AAA")
+        # Warm up the currency conversion rate cache.
+        self.client.get(reverse("base:home"))
+
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse("base:home"))
+        self.assertContains(response, "AAA")
+
+        for ticker in ["BBB", "CCC", "DDD", "EEE"]:
+            self.add_holding(ticker)
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse("base:home"))
+        self.assertContains(response, "EEE")
+
+
+@override_settings(
+    MARKET_DATA_PROVIDERS={
+        "quotes": {"BACKEND": "base.providers.GoogleFinanceQuoteProvider"},
+        "fx": {"BACKEND": "base.providers.XeFxProvider"},
+    }
+)
+class OpenCircuitTest(PortfolioTestCase):
+    def test_home_serves_stored_prices_and_rates(self):
+        self.add_holding("AAA")
+        stale = timezone.now() - timedelta(days=2)
+        Stock.objects.update(last_updated=stale)
+        CurrencyConversionRate.objects.update(last_updated=stale)
+
+        with contextlib.ExitStack() as stack:
+            for host in ["www.google.com", "www.xe.com"]:
+                semaphore, breaker = client.host_limits(host)
+                stack.enter_context(
+                    mock.patch.object(breaker, "opened_at", time.monotonic())
+                )
+            response = self.client.get(reverse("base:home"))
+
+        self.assertContains(response, "AAA")
+        self.assertContains(response, "US$20.00")
+        # The stale price and rate are kept, so that they are fetched again.
+        self.assertEqual(Stock.objects.get().last_updated, stale)
+        self.assertEqual(CurrencyConversionRate.objects.get().last_updated, stale)
+
+
+class PortfolioSummaryTest(PortfolioTestCase):
+    def test_portfolio_summary(self):
+        self.add_holding("AAA")
+        self.add_holding("BBB")
+        self.user.cash = Decimal("100")
+        self.user.save()
+
+        with self.assertNumQueries(1):
+            summary = OwnedStock.objects.portfolio_summary(self.user)
+
+        # Each holding owns 2 stocks bought at 5 each, priced at 10 each,
+        # and sold 2 stocks at 5 each, at no profit.
+        self.assertEqual(summary["total_value"], Decimal("40"))
+        self.assertEqual(summary["nav"], Decimal("140"))
+        self.assertEqual(summary["total_unrealised_pnl"], Decimal("20"))
+        self.assertEqual(summary["total_realised_pnl"], Decimal("0"))
+
+        response = self.client.get(reverse("base:api-portfolio"))
+        self.assertEqual(response.json()["nav"], "140.00")
+
+
+class PriceChangeTest(PortfolioTestCase):
+    def test_holdings_are_annotated_with_past_closes(self):
+        self.add_holding("AAA")
+        stock = Stock.objects.get(ticker="AAA")
+        today = timezone.localdate()
+        for days, close in [(10, "6"), (7, "7"), (3, "8"), (1, "9")]:
+            DailyPrice.objects.record(
+                [Stock(pk=stock.pk, _price=Decimal(close))], today - timedelta(days=days)
+            )
+        # Today's close is ignored.
+        DailyPrice.objects.record([stock], today)
+
+        with self.assertNumQueries(1):
+            holding = self.user.get_holdings().with_price_changes().get()
+        self.assertEqual(holding.previous_close, Decimal("9"))
+        self.assertEqual(holding.week_close, Decimal("7"))
+
+        response = self.client.get(reverse("base:home"))
+        # Priced at 10, and owns 2 stocks.
+        self.assertContains(response, "US$2.00")
+        self.assertContains(response, "US$6.00")
+
+
+class PortfolioSnapshotTest(PortfolioTestCase):
+    def test_snapshots_are_taken_incrementally(self):
+        today = timezone.localdate()
+
+        def noon(days):
+            return PortfolioSnapshot.start_of(today - timedelta(days=days)) + timedelta(
+                hours=12
+            )
+
+        stock = Stock.objects.create(ticker="AAA", exchange="NYSE", _price=Decimal("10"))
+        Transfer.objects.create(
+            user=self.user,
+            method="deposit",
+            value=Decimal("100"),
+            old_cash=Decimal(),
+            new_cash=Decimal("100"),
+            datetime=noon(5),
+        )
+        TransactionManager.create_transaction_and_update_owned_stock(
+            self.user, stock, noon(4), Decimal("5"), Decimal("2"), "buy"
+        )
+        for days, close in [(4, "6"), (2, "8")]:
+            stock._price = Decimal(close)
+            DailyPrice.objects.record([stock], today - timedelta(days=days))
+
+        self.assertEqual(PortfolioSnapshot.take(self.user), 5)
+        self.assertEqual(PortfolioSnapshot.take(self.user), 0)
+
+        TransactionManager.create_transaction_and_update_owned_stock(
+            self.user, stock, noon(1), Decimal("5"), Decimal("1"), "sell"
+        )
+        self.assertEqual(
+            PortfolioSnapshot.take(self.user, since=today - timedelta(days=1)), 1
+        )
+
+        response = self.client.get(
+            reverse("base:api-equity-curve"), {"start": str(today - timedelta(days=4))}
+        )
+        self.assertEqual(
+            [snapshot["nav"] for snapshot in response.json()["snapshots"]],
+            ["112.00", "112.00", "116.00", "108.00"],
+        )
+
+        # Less the 10 bought on the 4th last day, and plus the 5 sold on the last day.
+        analytics = self.client.get(reverse("base:api-analytics")).json()["analytics"]
+        self.assertAlmostEqual(analytics["twr"], 102 / 100 * 116 / 112 * 113 / 116 - 1)
+
+
+@override_settings(HISTORY_PAGE_SIZE=3)
+class HistoryTest(PortfolioTestCase):
+    def test_history_is_paginated(self):
+        # Both holdings have transactions at the same times, so pages split a tie.
+        for ticker in ["AAA", "BBB"]:
+            self.add_holding(ticker)
+
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("base:history"))
+        first_page = response.context["transactions"]
+
+        response = self.client.get(
+            reverse("base:history"),
+            {"after": response.context["next_cursor"], "start": 3},
+        )
+        second_page = response.context["transactions"]
+        self.assertIsNone(response.context["next_cursor"])
+        self.assertContains(response, "<td>6</td>")
+
+        transactions = first_page + second_page
+        self.assertEqual(len({t.id for t in transactions}), 6)
+        self.assertEqual(
+            [(t.datetime, t.id) for t in transactions],
+            sorted([(t.datetime, t.id) for t in transactions], reverse=True),
+        )
+
+        response = self.client.get(reverse("base:history-transfers"))
+        self.assertContains(response, "No transfer records.")
+
+
+class ExportTest(PortfolioTestCase):
+    def test_history_is_streamed(self):
+        self.add_holding("AAA")
+
+        response = self.client.get(reverse("base:export", args=["transactions"]))
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "id,datetime,ticker,direction,quantity,unit_price")
+        self.assertEqual(len(lines), 4)
+        self.assertIn(",AAA,sell,2.00,5.00", lines[3])
+
+        response = self.client.get(
+            reverse("base:export", args=["transfers"]), {"format": "json"}
+        )
+        self.assertEqual(json.loads(b"".join(response.streaming_content)), [])
+
+
+class ImportTest(PortfolioTestCase):
+    def test_import_round_trips_an_export(self):
+        self.add_holding("AAA")
+        self.add_holding("BBB")
+        response = self.client.get(reverse("base:export", args=["transactions"]))
+        export = b"".join(response.streaming_content)
+        other = User.objects.create_user(username="other", email="other@example.com")
+
+        count, errors = import_transactions(other, io.BytesIO(export))
+
+        self.assertEqual((count, errors), (6, []))
+        self.assertEqual(
+            list(other.get_holdings().values_list("current_quantity", "realised_pnl")),
+            list(self.user.get_holdings().values_list("current_quantity", "realised_pnl")),
+        )
+
+    def test_nothing_is_imported_if_a_row_is_invalid(self):
+        file = io.StringIO(
+            "ticker,datetime,direction,quantity,unit_price\n"
+            "AAA,2024-01-02 10:00,buy,1,5\n"
+            ",2024-01-02 10:00,hold,1,5\n"
+        )
+        Stock.objects.create(ticker="AAA", exchange="NYSE", _price=Decimal("10"))
+
+        count, errors = import_transactions(self.user, file)
+
+        self.assertEqual(count, 0)
+        self.assertEqual(len(errors), 1)
+        self.assertIn("Line 3: direction", errors[0])
+        self.assertFalse(self.user.transaction_set.exists())
+
+
+class TransferCashTest(PortfolioTestCase):
+    def test_transfers_update_cash_in_the_database(self):
+        # Another request changes the balance after this one loaded the user.
+        User.objects.filter(pk=self.user.pk).update(cash=Decimal("50"))
+
+        transfer = self.user.transfer_cash("deposit", Decimal("100"))
+        self.assertEqual((transfer.old_cash, transfer.new_cash), (50, 150))
+        self.assertIsNone(self.user.transfer_cash("withdrawal", Decimal("200")))
+
+        transfer = self.user.transfer_cash("set", Decimal("10"))
+        self.assertEqual((transfer.old_cash, transfer.new_cash), (150, 10))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.cash, Decimal("10"))
+        self.assertEqual(self.user.transfer_set.count(), 2)
+
+
+class QueryPlanTest(PortfolioTestCase):
+    @skipUnless(connection.vendor == "sqlite", "Other planners may scan tiny tables")
+    def test_hot_queries_use_the_indexes(self):
+        self.add_holding("AAA")
+        self.user.transfer_cash("deposit", Decimal("100"))
+        self.user.transfer_cash("withdrawal", Decimal("10"))
+
+        with override_settings(HISTORY_PAGE_SIZE=1):
+            queries = hot_queries()
+
+        for name, index in [
+            ("Open positions", "holding_open_position_idx"),
+            ("Holding lookup", "holding_user_stock_idx"),
+            ("Latest transaction", "transaction_holding_order_idx"),
+            ("Open lot scan", "lot_open_scan_idx"),
+            ("Holding replay", "transaction_holding_order_idx"),
+            ("Transaction history", "transaction_user_order_idx"),
+            ("Transfer history", "transfer_user_order_idx"),
+        ]:
+            with self.subTest(name):
+                self.assertIn(index, queries[name].explain())
+
+        # Open lots are read from the index alone.
+        self.assertIn(
+            "COVERING INDEX lot_open_scan_idx", queries["Open lot scan"].explain()
+        )
+
+
+class LockTest(PortfolioTestCase):
+    def test_lock_or_create_creates_a_single_holding(self):
+        stock = Stock.objects.create(ticker="AAA", exchange="NYSE", _price=Decimal("10"))
+
+        with db_transaction.atomic():
+            owned_stock = OwnedStock.objects.lock_or_create(self.user, stock)
+        with db_transaction.atomic():
+            self.assertEqual(
+                OwnedStock.objects.lock_or_create(self.user, stock), owned_stock
+            )
+        self.assertEqual(OwnedStock.objects.filter(user=self.user).count(), 1)
+
+    @skipUnless(connection.vendor == "sqlite", "SQLite has no SELECT ... FOR UPDATE")
+    def test_lock_takes_the_write_lock_even_if_nothing_matches(self):
+        with db_transaction.atomic():
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(OwnedStock.objects.filter(user=self.user).lock(), [])
+
+        self.assertTrue(queries[0]["sql"].startswith("UPDATE"))
+
+
+class LockOutsideTransactionTest(TransactionTestCase):
+    def test_lock_has_to_be_called_in_an_atomic_block(self):
+        with self.assertRaises(TransactionManagementError):
+            OwnedStock.objects.filter(pk=1).lock()
+
+
+class JournalTest(PortfolioTestCase):
+    def test_rebuild_matches_holdings_and_cash(self):
+        self.add_holding("AAA")
+        self.user.transfer_cash("deposit", Decimal("100"))
+        take_snapshot(self.user)
+
+        # Events after the snapshot: a back-dated buy, a deletion and a transfer.
+        stock = Stock.objects.get(ticker="AAA")
+        transaction, owned_stock = (
+            TransactionManager.create_transaction_and_update_owned_stock(
+                user=self.user,
+                stock=stock,
+                datetime=timezone.now() - timedelta(days=5),
+                unit_price=Decimal("3"),
+                quantity=Decimal("1"),
+                direction="buy",
+            )
+        )
+        owned_stock.remove_transaction(owned_stock.transaction_set.latest("datetime"))
+        self.user.transfer_cash("withdrawal", Decimal("30"))
+
+        cash, positions, last_event_id = rebuild(self.user)
+        owned_stock.refresh_from_db()
+        book = positions[stock.pk].book
+        self.assertEqual(cash, Decimal("70"))
+        self.assertEqual(book.quantity, owned_stock.current_quantity)
+        self.assertEqual(book.cost, owned_stock.cost_basis)
+        self.assertEqual(book.realised_pnl, owned_stock.realised_pnl)
+        self.assertEqual(regenerate(self.user, save=False), [])
+
+        # The read models are regenerated from the journal.
+        User.objects.filter(pk=self.user.pk).update(cash=Decimal("1"))
+        self.assertEqual(regenerate(self.user), ["cash: 1.00 instead of 70.00"])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.cash, Decimal("70"))
+
+
+class RebuildPositionsTest(PortfolioTestCase):
+    def test_rebuild_matches_update_instance(self):
+        for ticker in ["AAA", "BBB"]:
+            self.add_holding(ticker)
+        owned_stocks = OwnedStock.objects.filter(user=self.user)
+        expected = list(owned_stocks.values_list(*OwnedStock.POSITION_FIELDS))
+        lots = list(Lot.objects.values_list("transaction", "remaining_quantity"))
+
+        owned_stocks.update(current_quantity=0, realised_pnl=0)
+        Lot.objects.all().delete()
+        self.assertEqual(rebuild_users([self.user.pk]), (2, 6))
+
+        self.assertEqual(
+            list(owned_stocks.values_list(*OwnedStock.POSITION_FIELDS)), expected
+        )
+        self.assertCountEqual(
+            Lot.objects.values_list("transaction", "remaining_quantity"), lots
+        )
+        self.assertEqual(LotConsumption.objects.count(), 2)
+        self.assertEqual(
+            rebuild_users([self.user.pk], since=timezone.now() - timedelta(hours=1)),
+            (0, 0),
+        )
+
+    @skipUnless(connection.vendor == "sqlite", "Other databases rebuild in parallel")
+    def test_rebuild_positions_uses_one_process_on_sqlite(self):
+        self.add_holding("AAA")
+        other = User.objects.create_user(username="other", email="other@example.com")
+        stock = Stock.objects.get(ticker="AAA")
+        TransactionManager.create_transaction_and_update_owned_stock(
+            other, stock, timezone.now(), Decimal("5"), Decimal("2"), "buy"
+        )
+        expected = list(
+            OwnedStock.objects.order_by("pk").values_list(*OwnedStock.POSITION_FIELDS)
+        )
+        OwnedStock.objects.update(current_quantity=0)
+
+        out = io.StringIO()
+        call_command(
+            "rebuild_positions", "--workers", "4", "--batch-size", "1", stdout=out
+        )
+
+        self.assertIn("rebuilding in 1 process", out.getvalue())
+        self.assertIn("Rebuilt 2 positions of 2 users", out.getvalue())
+        self.assertEqual(
+            list(
+                OwnedStock.objects.order_by("pk").values_list(
+                    *OwnedStock.POSITION_FIELDS
+                )
+            ),
+            expected,
+        )
+
+
+class FxRateCacheTest(PortfolioTestCase):
+    def test_rates_are_served_from_cache(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(fx_rates.get_rate("USD", self.user.hc), Decimal("1.35"))
+        with self.assertNumQueries(0):
+            self.assertEqual(fx_rates.get_rate("USD", self.user.hc), Decimal("1.35"))
+
+        # Another worker process only shares Django's cache.
+        fx_rates.local.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(fx_rates.get_rate("USD", self.user.hc), Decimal("1.35"))
+
+        stats = fx_rates.stats()
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["local_hits"], 1)
+        self.assertEqual(stats["shared_hits"], 1)
+
+
+class FakeProviderTest(PortfolioTestCase):
+    def test_looking_up_a_new_ticker_finds_the_exchange(self):
+        stock, error = look_up_stock(self.user, "aapl")
+
+        self.assertIsNone(error)
+        self.assertTrue(stock._state.adding)
+        self.assertEqual(stock.ticker, "AAPL")
+        self.assertEqual(Stock.get_stock_price("AAPL"), (stock._price, stock.exchange))
+
+
+class FlakyProvider(FakeProvider):
+    """A FakeProvider whose requests to the exchanges in down fail."""
+
+    def __init__(self, down=(), tickers=None):
+        super().__init__(tickers)
+        self.down = set(down)
+
+    def get_price(self, ticker, exchange):
+        if exchange in self.down:
+            raise requests.ConnectionError(f"{exchange} is down.")
+        return super().get_price(ticker, exchange)
+
+    get_prices = QuoteProvider.get_prices
+
+
+class ExchangeResolutionTest(PortfolioTestCase):
+    def test_failed_probes_are_not_remembered_as_misses(self):
+        exchanges = [choice[0] for choice in EXCHANGE_CHOICES]
+        exchange = next(e for e in exchanges if FakeProvider().get_price("AAPL", e))
+        TickerExchange.remember("AAPL", exchange)
+        TickerExchange.objects.update(resolved_at=timezone.now() - timedelta(days=365))
+
+        other = next(
+            ticker
+            for ticker in ["IBM", "KO", "MSFT", "T"]
+            if not FakeProvider().get_price(ticker, exchange)
+        )
+
+        provider = FlakyProvider([exchange], tickers=["AAPL", other])
+        with mock.patch("base.models.get_quote_provider", return_value=provider):
+            with self.assertRaises(requests.ConnectionError):
+                Stock.get_stock_price("AAPL")
+            # Not a miss either, as it may be traded in the exchange that failed.
+            with self.assertRaises(requests.ConnectionError):
+                Stock.get_stock_price("ZZZZ")
+            # Found in an exchange that answered, even though another one failed.
+            self.assertIsNotNone(Stock.get_stock_price(other))
+
+        self.assertEqual(TickerExchange.objects.get(ticker="AAPL").exchange, exchange)
+        self.assertFalse(TickerExchange.objects.filter(ticker="ZZZZ").exists())
+
+        self.assertEqual(Stock.get_stock_price("AAPL")[1], exchange)
+
+
+@override_settings(
+    MARKET_DATA_PROVIDERS={
+        "quotes": {
+            "BACKEND": "base.providers.FakeProvider",
+            "OPTIONS": {"tickers": ["AAA", "BBB"]},
+        },
+        "fx": {"BACKEND": "base.providers.FakeProvider"},
+    },
+    TICKER_LOOKUP_RATE_LIMIT=(2, 60),
+)
+class TickerSearchTest(PortfolioTestCase):
+    def setUp(self):
+        super().setUp()
+        invalid_tickers.clear()
+
+    def test_invalid_tickers_are_cached(self):
+        self.assertEqual(find_stock(self.user, "ZZZ"), (None, "Ticker is invalid."))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(find_stock(self.user, "zzz"), (None, "Ticker is invalid."))
+
+    def test_failed_lookups_are_not_cached(self):
+        exchanges = [choice[0] for choice in EXCHANGE_CHOICES]
+        with mock.patch(
+            "base.models.get_quote_provider", return_value=FlakyProvider(exchanges)
+        ):
+            stock, error = find_stock(self.user, "AAA")
+        self.assertIsNone(stock)
+        self.assertIn("try again later", error)
+        self.assertNotIn("AAA", invalid_tickers)
+
+        self.assertIsNotNone(find_stock(self.user, "AAA")[0])
+
+    def test_new_ticker_lookups_are_rate_limited(self):
+        self.assertIsNotNone(find_stock(self.user, "AAA")[0])
+        self.assertIsNone(find_stock(self.user, "YYY")[0])
+
+        stock, error = find_stock(self.user, "BBB")
+        self.assertIsNone(stock)
+        self.assertIn("too many", error)
+        # Known tickers are not rate limited.
+        self.assertIsNotNone(find_stock(self.user, "AAA")[0])
+
+    def test_imported_tickers_are_looked_up_like_searches(self):
+        file = io.StringIO(
+            "ticker,datetime,direction,quantity,unit_price\n"
+            "AAA,2024-01-02 10:00,buy,1,5\n"
+            "ZZZ,2024-01-02 10:00,buy,1,5\n"
+        )
+
+        count, errors = import_transactions(self.user, file)
+
+        self.assertEqual(count, 0)
+        self.assertEqual(errors, ["Line 3: ticker: ZZZ: Ticker is invalid."])
+        self.assertIn("ZZZ", invalid_tickers)
+        self.assertFalse(self.user.transaction_set.exists())
+        # AAA is valid, so it is kept for when the file is imported again.
+        stock = Stock.objects.get()
+        self.assertEqual(stock.ticker, "AAA")
+        self.assertTrue(DailyPrice.objects.filter(stock=stock).exists())
+
+    @override_settings(
+        MARKET_DATA_PROVIDERS={
+            "quotes": {
+                "BACKEND": "base.providers.FakeProvider",
+                "OPTIONS": {"tickers": ["AAA", "BBB", "CCC", "DDD"]},
+            },
+            "fx": {"BACKEND": "base.providers.FakeProvider"},
+        }
+    )
+    def test_imports_are_not_limited_by_searches(self):
+        file = io.StringIO(
+            "ticker,datetime,direction,quantity,unit_price\n"
+            "AAA,2024-01-02 10:00,buy,1,5\n"
+            "BBB,2024-01-02 10:00,buy,1,5\n"
+            "CCC,2024-01-02 10:00,buy,1,5\n"
+        )
+
+        # More new tickers than can be searched for.
+        self.assertEqual(import_transactions(self.user, file), (3, []))
+        self.assertEqual(self.user.get_holdings().count(), 3)
+        # Nor do imports use up searches.
+        self.assertIsNotNone(find_stock(self.user, "DDD")[0])
+
+    @override_settings(TICKER_IMPORT_RATE_LIMIT=(1, 60))
+    def test_imports_have_their_own_rate_limit(self):
+        file = io.StringIO(
+            "ticker,datetime,direction,quantity,unit_price\n"
+            "AAA,2024-01-02 10:00,buy,1,5\n"
+            "BBB,2024-01-02 10:00,buy,1,5\n"
+        )
+
+        count, errors = import_transactions(self.user, file)
+
+        self.assertEqual(count, 0)
+        self.assertEqual(
+            errors,
+            [
+                "Line 3: ticker: BBB: You have imported too many new tickers. "
+                "Please try again later."
+            ],
+        )
+        self.assertTrue(Stock.objects.filter(ticker="AAA").exists())
+
+    def test_new_tickers_are_created_with_the_import(self):
+        file = io.StringIO(
+            "ticker,datetime,direction,quantity,unit_price\n"
+            "AAA,2024-01-02 10:00,buy,1,5\n"
+            "AAA,2024-01-03 10:00,buy,1,5\n"
+        )
+
+        self.assertEqual(import_transactions(self.user, file), (2, []))
+        stock = Stock.objects.get(ticker="AAA")
+        self.assertTrue(DailyPrice.objects.filter(stock=stock).exists())
+        self.assertEqual(
+            self.user.get_holdings().get().current_quantity, Decimal("2")
+        )
+
+
+class FindTextTest(SimpleTestCase):
+    def test_finds_the_first_element_with_the_classes(self):
+        chunks = [b'<p class="rate">0.1</p><p class="a b c">1.3', b"5 <b>SGD</b></p>", b"<p"]
+
+        self.assertEqual(find_text(chunks, "p", "b a"), "1.35 SGD")
+        self.assertIsNone(find_text("<p class='a'>1.35</p>", "p", "b"))
+
+
+class CircuitBreakerTest(SimpleTestCase):
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+        breaker.failed()
+        self.assertTrue(breaker.allow())
+
+        breaker.failed()
+        self.assertFalse(breaker.allow())
+
+        breaker.succeeded()
+        self.assertTrue(breaker.allow())
+
+
+class SingleFlightTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_callers_share_a_single_fetch(self):
+        fetches = []
+        callers = 8
+
+        def fetch():
+            # Hold off until every other caller waits on this one.
+            while key_locks["price"][1] < callers:
+                time.sleep(0.01)
+            fetches.append(1)
+
+        threads = [
+            threading.Thread(
+                target=single_flight, args=("price", fetch, lambda: bool(fetches))
+            )
+            for _ in range(callers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+
+        self.assertEqual(len(fetches), 1)
+        # The lock is dropped once its last waiter leaves.
+        self.assertEqual(key_locks, {})
+
+    def test_lease_of_a_failed_leader_expires(self):
+        fetches = []
+
+        # A leader in another process that died without releasing its lease.
+        acquire_lease("price", timeout=1)
+        single_flight("price", lambda: fetches.append(1), lambda: False, timeout=1)
+        self.assertEqual(fetches, [])
+
+        single_flight("price", lambda: fetches.append(1), lambda: False, timeout=1)
+        self.assertEqual(fetches, [1])
+
+        # A leader that failed in this process releases its lease.
+        with self.assertRaises(ValueError):
+            single_flight("price", mock.Mock(side_effect=ValueError), lambda: False)
+        single_flight("price", lambda: fetches.append(1), lambda: False)
+        self.assertEqual(fetches, [1, 1])
+        self.assertEqual(key_locks, {})
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    """Serves a page with the price near its start, and counts the connections it is served on."""
+
+    protocol_version = "HTTP/1.1"
+    connections = 0
+    body = b'<div class="price">1.35</div>' + b"<p>filler</p>" * 20000
+
+    def handle(self):
+        PageHandler.connections += 1
+        try:
+            super().handle()
+        except ConnectionResetError:
+            # The client dropped the connection instead of reading the rest of the page.
+            pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpClientTest(SimpleTestCase):
+    def setUp(self):
+        PageHandler.connections = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), PageHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+
+    def make_client(self, max_drain=1024 * 1024):
+        return HttpClient(
+            timeout=(1, 1),
+            retries=0,
+            backoff=0,
+            max_per_host=1,
+            breaker_threshold=5,
+            breaker_reset_timeout=60,
+            max_drain=max_drain,
+        )
+
+    def scrape(self, client):
+        with client.get(self.url) as response:
+            return find_text(response.iter_content(1024), "div", "price")
+
+    def test_connections_are_reused_after_a_partial_read(self):
+        client = self.make_client()
+        for _ in range(5):
+            self.assertEqual(self.scrape(client), "1.35")
+        self.assertEqual(PageHandler.connections, 1)
+
+    def test_slots_are_released_after_any_error(self):
+        client = self.make_client()
+        client.session = mock.Mock()
+        client.session.get.side_effect = requests.TooManyRedirects
+
+        # A leaked slot would make the second request time out waiting for it.
+        for _ in range(2):
+            with self.assertRaises(requests.TooManyRedirects):
+                with client.get(self.url):
+                    pass
+
+        semaphore, breaker = client.host_limits(f"127.0.0.1:{self.server.server_port}")
+        self.assertTrue(semaphore.acquire(blocking=False))
+
+    def test_connections_are_dropped_if_too_much_is_left(self):
+        client = self.make_client(max_drain=1024)
+        for _ in range(2):
+            self.assertEqual(self.scrape(client), "1.35")
+        self.assertEqual(PageHandler.connections, 2)
+
+
+class AnalyticsTest(SimpleTestCase):
+    def test_analyse_series(self):
+        days = np.arange(738000, 739096, 365)
+        # A deposit of 100 in the 3rd year, on top of a 10% gain and a 10% loss.
+        navs = np.array([100.0, 110.0, 199.0, 219.0])
+        flows = np.array([0.0, 0.0, 100.0, 0.0])
+
+        analytics = analyse_series(days, navs, flows)
+
+        self.assertAlmostEqual(analytics["twr"], 1.1 * 0.9 * 219 / 199 - 1)
+        self.assertAlmostEqual(analytics["max_drawdown"], 0.1)
+        # Investing 100 and then 100 grows to 219 at the money-weighted return.
+        mwr = analytics["mwr"]
+        self.assertAlmostEqual(
+            100 * (1 + mwr) ** 3 + 100 * (1 + mwr), 219, places=6
+        )
@@ -28,6 +28,9 @@ urlpatterns = [
     path("search/", views.search, name="search"),
     path("transfer/", views.transfer, name="transfer"),
     path("history/", views.history, name="history"),
+    path("history/transfers/", views.history_transfers, name="history-transfers"),
+    path("import/", views.import_history, name="import"),
+    path("export/<str:kind>/", views.export, name="export"),
     path("logout/", views.logout_page, name="logout"),
     path("settings/", views.settings, name="settings"),
     path(
@@ -44,4 +47,8 @@ urlpatterns = [
     ),
     path("transact/<int:pk>/", views.transact, name="transact"),
     path("delete/<int:pk>/", views.delete_transaction, name="delete"),
+    path("api/portfolio/", views.portfolio_summary, name="api-portfolio"),
+    path("api/equity-curve/", views.equity_curve, name="api-equity-curve"),
+    path("api/analytics/", views.analytics, name="api-analytics"),
+    path("api/fx-cache/", views.fx_cache_stats, name="api-fx-cache"),
 ]
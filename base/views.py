@@ -1,21 +1,38 @@
+from datetime import date
+
+from django.conf import settings as django_settings
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.views import LoginView, PasswordChangeView
-from django.http import Http404, HttpResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from django.utils import timezone
 from django.views.decorators.http import require_POST
 
+from .analytics import analyse
+from .export import EXPORTS, FORMATS, stream_export
 from .forms import (
     CustomAuthenticationForm,
     CustomChangePasswordForm,
+    ImportTransactionsForm,
     MyUserCreationForm,
     TransactionForm,
     TransferForm,
     UserSettingsForm,
 )
-from .models import OwnedStock, Stock, Transaction, TransactionManager, Transfer, User
+from .fx import fx_rates
+from .imports import import_transactions
+from .models import (
+    OwnedStock,
+    PortfolioSnapshot,
+    Stock,
+    Transaction,
+    TransactionManager,
+    User,
+)
+from .pagination import keyset_page
+from .search import find_stock
 from .templatetags.base_extras import usd
 
 
@@ -52,41 +69,73 @@ def logout_page(request):
 @login_required()
 def home(request):
     user: User = request.user
-    holdings = user.get_holdings()
-    nav = user.get_nav(holdings)
-
-    total_unrealised_pnl = sum(
-        [
-            (ownedStock.stock.price - ownedStock.average_cost_price)  # type:ignore
-            * ownedStock.current_quantity
-            for ownedStock in holdings
-        ]
-    )
-    total_realised_pnl = sum([ownedStock.realised_pnl for ownedStock in holdings])  # type: ignore
+    dashboard = user.get_dashboard()
 
     context = {
-        "holdings": holdings,
-        "total": nav,
-        "tup": total_unrealised_pnl,
-        "trp": total_realised_pnl,
+        "holdings": dashboard["holdings"],
+        "total": dashboard["nav"],
+        "tup": dashboard["tup"],
+        "trp": dashboard["trp"],
     }
     return render(request, "base/home.html", context)
 
 
+@login_required
+def portfolio_summary(request):
+    user: User = request.user
+
+    if not django_settings.BACKGROUND_QUOTE_REFRESH:
+        Stock.refresh_prices([ownedStock.stock for ownedStock in user.get_holdings()])
+
+    return JsonResponse(OwnedStock.objects.portfolio_summary(user))
+
+
+@login_required
+def equity_curve(request):
+    """
+    Serves the user's daily cash, value of holdings and net account value between the
+    optional start and end dates (YYYY-MM-DD) from their portfolio snapshots.
+    """
+    snapshots = PortfolioSnapshot.objects.filter(user=request.user)
+    try:
+        if request.GET.get("start"):
+            start = date.fromisoformat(request.GET["start"])
+            snapshots = snapshots.filter(date__gte=start)
+        if request.GET.get("end"):
+            end = date.fromisoformat(request.GET["end"])
+            snapshots = snapshots.filter(date__lte=end)
+    except ValueError:
+        return JsonResponse(
+            {"error": "Dates must be in the format YYYY-MM-DD."}, status=400
+        )
+
+    return JsonResponse(
+        {"snapshots": list(snapshots.values("date", "cash", "value", "nav"))}
+    )
+
+
+@login_required
+def analytics(request):
+    """Serves the user's returns, maximum drawdown and volatility from their snapshots."""
+    return JsonResponse({"analytics": analyse(request.user)})
+
+
+@staff_member_required
+def fx_cache_stats(request):
+    return JsonResponse(fx_rates.stats())
+
+
 @login_required
 def search(request):
     ticker = request.GET.get("ticker").upper() if request.GET.get("ticker") else None
     if not ticker:
         return render(request, "base/search.html", context={})
 
-    try:
-        stock = get_object_or_404(Stock, ticker=ticker)
-    except Http404:
-        # if 404, means call API and create new stock object
-        stock = Stock.create_stock_if_valid(ticker=ticker)
+    # If the ticker has not been searched before, call API and create new stock object
+    stock, error = find_stock(request.user, ticker)
 
     if not stock:
-        messages.error(request, "Ticker is invalid.")
+        messages.error(request, error)
         return redirect("base:search")
 
     q = request.user.ownedstock_set.filter(stock=stock)
@@ -114,33 +163,13 @@ def transfer(request):
             method = form.cleaned_data["method"]
             value = form.cleaned_data["value"]
 
-            if method == "deposit":
-                new_cash = user.cash + value
-            elif method == "withdrawal":
-                if value > user.cash:
-                    return HttpResponse(
-                        "Bad request: You want to withdraw more cash than you own."
-                    )
-                new_cash = user.cash - value
-            elif method == "set":
-                new_cash = value
-            else:
+            if method not in ["deposit", "withdrawal", "set"]:
                 return HttpResponse("The method is invalid")
 
-            now = timezone.now()
-
-            Transfer.objects.create(
-                user=user,
-                method=method,
-                old_cash=user.cash,
-                new_cash=new_cash,
-                datetime=now,
-                value=value,
-            )
-
-            user.cash = new_cash
-
-            user.save()
+            if not user.transfer_cash(method, value):
+                return HttpResponse(
+                    "Bad request: You want to withdraw more cash than you own."
+                )
 
             # Flash message upon next request
             def tense(method):
@@ -164,12 +193,84 @@ def transfer(request):
 
 @login_required
 def history(request):
-    transactions = request.user.transaction_set.all()
-    transfers = request.user.transfer_set.all()
-    context = {"transactions": transactions, "transfers": transfers}
+    transactions, cursor = keyset_page(
+        request.user.transaction_set.select_related("owned_stock__stock"),
+        request.GET.get("after"),
+        django_settings.HISTORY_PAGE_SIZE,
+    )
+    start = page_start(request)
+    context = {
+        "transactions": transactions,
+        "import_form": ImportTransactionsForm(),
+        "next_cursor": cursor,
+        "start": start,
+        "next_start": start + len(transactions),
+    }
     return render(request, "base/history.html", context=context)
 
 
+@login_required
+def history_transfers(request):
+    """Renders a page of transfer history, which is loaded when its tab is opened."""
+    transfers, cursor = keyset_page(
+        request.user.transfer_set.all(),
+        request.GET.get("after"),
+        django_settings.HISTORY_PAGE_SIZE,
+    )
+    start = page_start(request)
+    context = {
+        "transfers": transfers,
+        "next_cursor": cursor,
+        "start": start,
+        "next_start": start + len(transfers),
+    }
+    return render(request, "base/transfers.html", context=context)
+
+
+def page_start(request) -> int:
+    """Returns the number of rows before the requested page of the history."""
+    try:
+        return max(int(request.GET.get("start", 0)), 0)
+    except ValueError:
+        return 0
+
+
+@login_required
+def export(request, kind):
+    """Streams the user's transaction or transfer history as a CSV or JSON download."""
+    format = request.GET.get("format", "csv")
+    if kind not in EXPORTS or format not in FORMATS:
+        raise Http404
+
+    response = StreamingHttpResponse(
+        stream_export(request.user, kind, format), content_type=FORMATS[format]
+    )
+    response["Content-Disposition"] = f'attachment; filename="{kind}.{format}"'
+    return response
+
+
+@login_required
+@require_POST
+def import_history(request):
+    form = ImportTransactionsForm(request.POST, request.FILES)
+    if not form.is_valid():
+        messages.error(request, "Please choose a CSV file to import.")
+        return redirect("base:history")
+
+    count, errors = import_transactions(request.user, form.cleaned_data["file"])
+    if errors:
+        # Only show the first few errors, since a file may have thousands.
+        for error in errors[:5]:
+            messages.error(request, error)
+        if len(errors) > 5:
+            messages.error(request, f"And {len(errors) - 5} more errors.")
+        messages.error(request, "No transactions were imported.")
+    else:
+        messages.success(request, f"{count} transactions have been imported.")
+
+    return redirect("base:history")
+
+
 @login_required
 def settings(request):
     if request.method == "POST":
@@ -229,8 +330,9 @@ def transact(request, pk):
 @require_POST
 def delete_transaction(request, pk):
     transaction = get_object_or_404(Transaction, pk=pk)
-    stock = transaction.owned_stock.stock.ticker
-    transaction.delete()
+    owned_stock = transaction.owned_stock
+    stock = owned_stock.stock.ticker
+    owned_stock.remove_transaction(transaction)
     messages.success(
         request,
         f"Transaction with Transaction ID {pk} (ticker: {stock}) has successfully been deleted.",